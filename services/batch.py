@@ -0,0 +1,100 @@
+import json
+import logging
+import threading
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 200
+
+
+def _chunks(values, size):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+class BatchWriter:
+    """
+    Zbiera zmiany wierszy (id -> kolumny) i zapisuje je hurtowo. Kolejne zmiany tego samego
+    wiersza są scalane (późniejsza wygrywa). Przy flush wiersze z identycznym zestawem zmian
+    idą jednym `update().in_("id", ...)`, a pozostałe porcjami przez RPC bulk_update_rows
+    (sql/bulk_update_rows.sql). Bez tej funkcji w bazie zapis wraca do update per wiersz.
+    Bezpieczny wątkowo: `add` można wołać z wątków roboczych, `flush` z wątku głównego.
+    `on_add(row_id, changes)` pozwala podglądać zmiany przed zapisem (np. lokalny cache wierszy).
+    """
+
+    def __init__(self, supabase, table, chunk_size=CHUNK_SIZE, on_add=None):
+        self.supabase = supabase
+        self.table = table
+        self.chunk_size = chunk_size
+        self.on_add = on_add
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def add(self, row_id, changes):
+        if not changes: return
+        with self._lock:
+            self._pending.setdefault(row_id, {}).update(changes)
+        if self.on_add: self.on_add(row_id, changes)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        """Zapisuje zebrane zmiany. Zwraca zbiór id, których nie udało się zapisać."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending: return set()
+
+        groups = defaultdict(list)
+        for row_id, changes in pending.items():
+            groups[json.dumps(changes, sort_keys=True, default=str)].append(row_id)
+
+        failed = set()
+        singles = []
+        for ids in groups.values():
+            if len(ids) == 1:
+                singles.append({"id": ids[0], **pending[ids[0]]})
+                continue
+            for chunk in _chunks(ids, self.chunk_size):
+                try:
+                    self.supabase.table(self.table).update(pending[chunk[0]]).in_("id", chunk).execute()
+                except Exception as e:
+                    logger.warning("Batch update %s (%d wierszy): %s", self.table, len(chunk), e)
+                    failed.update(chunk)
+
+        for chunk in _chunks(singles, self.chunk_size):
+            failed.update(self._write_rows(chunk))
+        return failed
+
+    def _write_rows(self, rows):
+        if len(rows) > 1:
+            try:
+                self.supabase.rpc("bulk_update_rows", {"p_table": self.table, "p_rows": rows}).execute()
+                return set()
+            except Exception as e:
+                logger.warning("bulk_update_rows %s niedostępne (%s) - zapis per wiersz", self.table, e)
+        failed = set()
+        for row in rows:
+            changes = {k: v for k, v in row.items() if k != "id"}
+            try:
+                self.supabase.table(self.table).update(changes).eq("id", row['id']).execute()
+            except Exception as e:
+                logger.warning("Update %s id=%s: %s", self.table, row['id'], e)
+                failed.add(row['id'])
+        return failed
+
+
+def diff_rows(original, edited, columns, key="id"):
+    """
+    Porównuje dwie ramki (np. dane wejściowe i stan st.data_editor) po kluczu, wektorowo.
+    Zwraca słownik id -> {kolumna: nowa wartość} dla wierszy, w których zmieniła się
+    którakolwiek z `columns` (None i NaN traktowane jak brak wartości).
+    """
+    after = edited.set_index(key)[columns]
+    before = original.set_index(key)[columns].reindex(after.index)
+    changed = (before.fillna("").astype(str) != after.fillna("").astype(str)).any(axis=1)
+    rows = after[changed].astype(object)
+    rows = rows.where(rows.notna(), None)
+    return {(k.item() if hasattr(k, "item") else k): v for k, v in rows.to_dict("index").items()}
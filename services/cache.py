@@ -0,0 +1,129 @@
+import json
+import time
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+from services import http_cache
+
+
+def canonical_hash(value):
+    """Stabilny hash słownika filtrów (kolejność kluczy i typy list nie mają znaczenia)."""
+    def normalize(v):
+        if isinstance(v, dict): return {str(k): normalize(x) for k, x in v.items()}
+        if isinstance(v, (list, tuple, set)): return sorted((normalize(x) for x in v), key=str)
+        return v
+    payload = json.dumps(normalize(value), sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def _size_of(value):
+    try: return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception: return 1024
+
+
+class TTLCache:
+    """
+    Procesowy cache LRU z TTL per wpis i limitem pamięci (w bajtach, szacowanym przez pickle).
+    Bezpieczny wątkowo; liczy trafienia, chybienia i usunięcia.
+    """
+
+    def __init__(self, name, max_bytes=64 * 1024 * 1024, default_ttl=600):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self._data = OrderedDict() # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.time():
+                if entry is not None: self._remove(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and entry[0] >= time.time()
+
+    def set(self, key, value, ttl=None):
+        size = _size_of(value)
+        with self._lock:
+            if key in self._data: self._remove(key)
+            if size > self.max_bytes: return
+            self._data[key] = (time.time() + (ttl or self.default_ttl), size, value)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def get_or_set(self, key, factory, ttl=None):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = factory()
+            self.set(key, value, ttl=ttl)
+        return value
+
+    def _remove(self, key):
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def invalidate(self, key):
+        with self._lock:
+            if key in self._data: self._remove(key)
+
+    def invalidate_where(self, predicate):
+        """Usuwa wpisy, których klucz spełnia `predicate` (np. wszystkie dla projektu)."""
+        with self._lock:
+            for key in [k for k in self._data if predicate(k)]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "cache": self.name,
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+_MISSING = object()
+
+# Cache współdzielone przez wszystkie sesje procesu
+offers_cache = TTLCache("offers", max_bytes=32 * 1024 * 1024, default_ttl=1800)
+search_cache = TTLCache("search", max_bytes=32 * 1024 * 1024, default_ttl=300)
+stats_cache = TTLCache("stats", max_bytes=1024 * 1024, default_ttl=30)
+
+
+def all_stats():
+    return [c.stats() for c in (offers_cache, search_cache, stats_cache)]
+
+
+def invalidate_project(project_id):
+    """
+    Unieważnia oferty i wyniki wyszukiwania projektu (klucze zaczynają się od project_id)
+    oraz jego odpowiedzi w dyskowym http_cache - inaczej wróciłyby stamtąd te same dane.
+    """
+    project_id = str(project_id)
+    for cache in (offers_cache, search_cache):
+        cache.invalidate_where(lambda k: k[0] == project_id)
+    http_cache.expire_project(project_id)
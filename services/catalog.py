@@ -0,0 +1,378 @@
+import json
+import time
+import hashlib
+import logging
+import threading
+import streamlit as st
+from services import local_store
+from concurrent.futures import ThreadPoolExecutor
+from services.cache import invalidate_project, search_cache, canonical_hash
+from services.portal_index import PortalIndex, active_filters
+
+logger = logging.getLogger(__name__)
+
+DB_NAME = "catalog.sqlite"
+
+# Wersja formatu wiersza w data_hash - zmiana mapowania kolumn wymusza przepisanie lustra przy refreshu
+ROW_FORMAT = "2"
+
+# Kolumny kategoryczne zapisywane jako ",v1,v2," (obsługuje pola skalarne i listy)
+CATEGORICAL = {
+    "categories": "portal_categories",
+    "portal_type": "portal_type",
+    "portal_country": "portal_country",
+    "portal_region": "portal_regions",   # lista, jak portal_categories
+    "portal_quality": "portal_quality",
+    "offer_dofollow": "offer_dofollow",
+    "offer_promo": "offer_promo",
+    "offer_link_type": "offer_link_type",
+    "offer_persistence": "offer_persistence",
+    "offer_tagging": "offer_tagging",
+}
+NUMERIC = {
+    "best_price": "best_price",
+    "dr": "portal_score_domain_rating",
+    "tf": "portal_score_trust_flow",
+    "uu": "portal_unique_users",
+}
+
+# Klucz filtra z render_filters_form -> pole portalu, które musi występować w snapshocie
+FILTER_FIELDS = {
+    "price_min": "best_price", "price_max": "best_price",
+    "min_dr": "portal_score_domain_rating", "min_tf": "portal_score_trust_flow",
+    "min_traffic": "portal_unique_users", "categories": "portal_categories",
+    "portal_url": "portal_url", "portal_type": "portal_type",
+    "portal_country": "portal_country", "portal_region": "portal_regions",
+    "portal_quality": "portal_quality", "offer_dofollow": "offer_dofollow",
+    "only_promo": "offer_promo", "offer_link_type": "offer_link_type",
+    "offer_persistence": "offer_persistence", "offer_tagging": "offer_tagging",
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS portals (
+    project_id TEXT NOT NULL,
+    portal_id TEXT NOT NULL,
+    position INTEGER,
+    data TEXT NOT NULL,
+    data_hash TEXT NOT NULL,
+    portal_url TEXT,
+    best_price REAL, dr REAL, tf REAL, uu REAL,
+    categories TEXT, portal_type TEXT, portal_country TEXT, portal_region TEXT, portal_quality TEXT,
+    offer_dofollow TEXT, offer_promo TEXT, offer_link_type TEXT, offer_persistence TEXT, offer_tagging TEXT,
+    updated_at REAL,
+    seen_at REAL,
+    PRIMARY KEY (project_id, portal_id)
+);
+CREATE INDEX IF NOT EXISTS portals_position ON portals (project_id, position);
+CREATE TABLE IF NOT EXISTS snapshots (
+    project_id TEXT PRIMARY KEY,
+    synced_at REAL,
+    total INTEGER,
+    changed INTEGER,
+    removed INTEGER,
+    fields TEXT,
+    status TEXT,
+    error TEXT,
+    lease_until REAL
+);
+"""
+
+_running = set()
+_running_lock = threading.Lock()
+
+# project_id -> (synced_at, PortalIndex); przebudowa po każdym nowym snapshocie
+_indexes = {}
+_index_lock = threading.Lock()
+
+# Strony wyników API pobierane w tle (klucz jak w search_cache)
+_page_pending = {}
+_page_lock = threading.Lock()
+_page_executor = None
+
+
+def _conn():
+    return local_store.connect(DB_NAME, _SCHEMA)
+
+
+def _encode(value):
+    if value is None or value == "": return ""
+    values = value if isinstance(value, (list, tuple, set)) else [value]
+    return "," + ",".join(str(v) for v in values) + ","
+
+
+def _number(value):
+    try: return float(value)
+    except (TypeError, ValueError): return None
+
+
+def _row_values(project_id, position, portal, now):
+    data = json.dumps(portal, sort_keys=True, ensure_ascii=False)
+    return (
+        str(project_id), str(portal.get('id')), position, data,
+        hashlib.sha1((ROW_FORMAT + data).encode("utf-8")).hexdigest(),
+        portal.get('portal_url') or portal.get('name') or "",
+        *[_number(portal.get(f)) for f in NUMERIC.values()],
+        *[_encode(portal.get(f)) for f in CATEGORICAL.values()],
+        now, now
+    )
+
+
+def snapshot_info(project_id):
+    """Stan lustra dla projektu: synced_at, total, changed, removed, fields, status, error (albo None)."""
+    row = _conn().execute("SELECT * FROM snapshots WHERE project_id = ?", (str(project_id),)).fetchone()
+    if row is None: return None
+    info = dict(row)
+    info['fields'] = set(json.loads(info['fields'] or "[]"))
+    return info
+
+
+def _acquire_lease(conn, project_id, seconds):
+    """Blokada między procesami: tylko jeden refresh projektu naraz na hoście."""
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    row = conn.execute("SELECT lease_until FROM snapshots WHERE project_id = ?", (project_id,)).fetchone()
+    if row and (row['lease_until'] or 0) > now:
+        conn.execute("ROLLBACK")
+        return False
+    conn.execute(
+        "INSERT INTO snapshots (project_id, status, lease_until) VALUES (?, 'refreshing', ?) "
+        "ON CONFLICT(project_id) DO UPDATE SET status = 'refreshing', lease_until = excluded.lease_until",
+        (project_id, now + seconds)
+    )
+    conn.execute("COMMIT")
+    return True
+
+
+def refresh(wp_api, project_id, batch_size=500, lease_seconds=1800):
+    """
+    Synchronizuje pełną listę portali projektu do lokalnego lustra.
+    Przyrostowo: zapisuje tylko nowe/zmienione wiersze, usuwa te, których API już nie zwraca.
+    Zwraca słownik z podsumowaniem albo None, jeśli refresh trwa w innym procesie.
+    """
+    project_id = str(project_id)
+    conn = _conn()
+    if not _acquire_lease(conn, project_id, lease_seconds):
+        return None
+
+    started = time.time()
+    known = dict(conn.execute("SELECT portal_id, data_hash FROM portals WHERE project_id = ?", (project_id,)).fetchall())
+    total = changed = 0
+    fields = set()
+    try:
+        upserts, touched = [], []
+
+        def flush():
+            conn.execute("BEGIN IMMEDIATE")
+            if upserts:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO portals VALUES (" + ",".join("?" * len(upserts[0])) + ")", upserts
+                )
+            conn.executemany(
+                "UPDATE portals SET position = ?, seen_at = ? WHERE project_id = ? AND portal_id = ?", touched
+            )
+            conn.execute("COMMIT")
+            upserts.clear(); touched.clear()
+
+        for portal in wp_api.iter_portals(project_id, {}, strict=True):
+            if portal.get('id') is None: continue
+            fields.update(k for k, v in portal.items() if v is not None)
+            values = _row_values(project_id, total, portal, started)
+            if known.get(values[1]) == values[4]:
+                touched.append((total, started, project_id, values[1]))
+            else:
+                upserts.append(values)
+                changed += 1
+            total += 1
+            if len(upserts) + len(touched) >= batch_size: flush()
+        flush()
+
+        if total == 0:
+            # Pusta odpowiedź to najczęściej błąd API - nie kasujemy poprzedniego snapshotu
+            raise RuntimeError("API nie zwróciło żadnych portali")
+
+        removed = conn.execute("DELETE FROM portals WHERE project_id = ? AND seen_at < ?", (project_id, started)).rowcount
+        conn.execute(
+            "UPDATE snapshots SET synced_at = ?, total = ?, changed = ?, removed = ?, fields = ?, "
+            "status = 'ok', error = NULL, lease_until = NULL WHERE project_id = ?",
+            (started, total, changed, removed, json.dumps(sorted(fields)), project_id)
+        )
+        return {"total": total, "changed": changed, "removed": removed}
+    except Exception as e:
+        if conn.in_transaction: conn.execute("ROLLBACK")
+        logger.warning("Catalog refresh %s failed: %s", project_id, e)
+        conn.execute(
+            "UPDATE snapshots SET status = 'error', error = ?, lease_until = NULL WHERE project_id = ?",
+            (str(e), project_id)
+        )
+        return {"total": total, "changed": changed, "removed": 0, "error": str(e)}
+
+
+def _max_age():
+    try:
+        return float(st.secrets.get("CATALOG", {}).get("MAX_AGE_SECONDS", 6 * 3600))
+    except Exception:
+        return 6 * 3600.0
+
+
+def ensure_fresh(wp_api, project_id, force=False):
+    """Uruchamia refresh w tle, jeśli lustro nie istnieje, jest przeterminowane lub `force`."""
+    project_id = str(project_id)
+    info = snapshot_info(project_id)
+    stale = force or not info or not info.get('synced_at') or time.time() - info['synced_at'] > _max_age()
+    if not stale: return False
+
+    with _running_lock:
+        if project_id in _running: return False
+        _running.add(project_id)
+
+    def run():
+        try:
+            result = refresh(wp_api, project_id)
+            if result and not result.get('error'):
+                get_index(project_id)
+                invalidate_project(project_id)
+        finally:
+            with _running_lock: _running.discard(project_id)
+
+    threading.Thread(target=run, name=f"catalog-{project_id}", daemon=True).start()
+    return True
+
+
+def is_refreshing(project_id):
+    return str(project_id) in _running
+
+
+def can_answer(project_id, filters, info=None):
+    """Czy lustro ma gotowy snapshot i wszystkie pola potrzebne do lokalnego przefiltrowania."""
+    info = info or snapshot_info(project_id)
+    if not info or not info.get('synced_at'): return False
+    for key in active_filters(filters):
+        field = FILTER_FIELDS.get(key)
+        if field is None or field not in info['fields']: return False
+    return True
+
+
+def _decode(value):
+    return [v for v in value.strip(",").split(",") if v] if value else []
+
+
+def _build_index(project_id):
+    cols = list(NUMERIC) + list(CATEGORICAL)
+    rows = _conn().execute(
+        f"SELECT portal_id, portal_url, {', '.join(cols)} FROM portals WHERE project_id = ? ORDER BY position",
+        (str(project_id),)
+    ).fetchall()
+    return PortalIndex(
+        portal_ids=[r['portal_id'] for r in rows],
+        numeric={c: [r[c] if r[c] is not None else float("nan") for r in rows] for c in NUMERIC},
+        categorical={c: [_decode(r[c]) for r in rows] for c in CATEGORICAL},
+        urls=[r['portal_url'] for r in rows]
+    )
+
+
+def get_index(project_id, info=None):
+    """Indeks NumPy bieżącego snapshotu projektu (budowany raz na snapshot, współdzielony w procesie)."""
+    project_id = str(project_id)
+    info = info or snapshot_info(project_id)
+    if not info or not info.get('synced_at'): return None
+    with _index_lock:
+        cached = _indexes.get(project_id)
+        if cached and cached[0] == info['synced_at']:
+            return cached[1]
+        index = _build_index(project_id)
+        _indexes[project_id] = (info['synced_at'], index)
+        return index
+
+
+def load_portals(project_id, portal_ids):
+    """Pełne rekordy portali z lustra, w kolejności `portal_ids`."""
+    if not portal_ids: return []
+    conn = _conn()
+    found = {}
+    for i in range(0, len(portal_ids), 500):
+        chunk = portal_ids[i:i + 500]
+        rows = conn.execute(
+            f"SELECT portal_id, data FROM portals WHERE project_id = ? AND portal_id IN ({','.join('?' * len(chunk))})",
+            [str(project_id)] + list(chunk)
+        ).fetchall()
+        found.update((r['portal_id'], json.loads(r['data'])) for r in rows)
+    return [found[pid] for pid in portal_ids if pid in found]
+
+
+def query_portals(project_id, filters, page=1, per_page=20, sort=None, descending=True):
+    """Odpowiednik WhitePressAPI.search_portals liczony na indeksie lustra. Zwraca (items, meta)."""
+    index = get_index(project_id)
+    if index is None:
+        return [], {"total_items": 0, "total_pages": 1, "current_page": page, "source": "catalog"}
+    portal_ids, meta = index.page(filters, page=page, per_page=per_page, sort=sort, descending=descending)
+    meta['source'] = "catalog"
+    return load_portals(project_id, portal_ids), meta
+
+
+def search(wp_api, project_id, filters, page=1, per_page=20):
+    """Wyszukiwanie z lustra, jeśli to możliwe; w przeciwnym razie zapytanie do API."""
+    if can_answer(project_id, filters):
+        return query_portals(project_id, filters, page=page, per_page=per_page)
+    with _page_lock:
+        future = _page_pending.get(_page_key(project_id, filters, page, per_page))
+    if future is not None:
+        # Strona jest właśnie pobierana w tle - czekamy na nią zamiast pytać API drugi raz
+        try:
+            items, meta = future.result()
+            return items, {**meta, "source": "api"}
+        except Exception:
+            pass
+    items, meta = wp_api.search_portals(project_id, filters, page=page, per_page=per_page)
+    return items, {**meta, "source": "api"}
+
+
+def _page_key(project_id, filters, page, per_page):
+    # Ten sam klucz co w search_cache (WhitePressAPI.search_portals)
+    return (str(project_id), canonical_hash(filters), page, per_page)
+
+
+def _get_page_executor():
+    global _page_executor
+    with _page_lock:
+        if _page_executor is None:
+            _page_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="page-prefetch")
+        return _page_executor
+
+
+def _fetch_page(wp_api, key, project_id, filters, page, per_page):
+    try:
+        return wp_api.search_portals(project_id, filters, page=page, per_page=per_page)
+    finally:
+        with _page_lock: _page_pending.pop(key, None)
+
+
+def prefetch_pages(wp_api, project_id, filters, page, per_page, total_pages, window=1):
+    """
+    Zleca w tle pobranie stron sąsiednich (page ± window), których nie ma w search_cache.
+    Dla zapytań obsługiwanych przez lustro nic nie robi - tam każda strona jest natychmiastowa.
+    Zwraca liczbę zleconych stron.
+    """
+    if can_answer(project_id, filters): return 0
+    total_pages = int(total_pages or 1)
+    executor = _get_page_executor()
+    submitted = 0
+    # Najpierw następna strona - najczęstszy kierunek przeglądania
+    for p in sorted(range(max(1, page - window), min(total_pages, page + window) + 1), key=lambda p: (p < page, abs(p - page))):
+        if p == page: continue
+        key = _page_key(project_id, filters, p, per_page)
+        with _page_lock:
+            if key in search_cache or key in _page_pending: continue
+            _page_pending[key] = executor.submit(_fetch_page, wp_api, key, project_id, filters, p, per_page)
+        submitted += 1
+    return submitted
+
+
+def iter_portals(wp_api, project_id, filters, max_items=None):
+    """Generator portali spełniających filtry: z lustra albo (fallback) z API."""
+    if not can_answer(project_id, filters):
+        yield from wp_api.iter_portals(project_id, filters, max_items=max_items)
+        return
+    index = get_index(project_id)
+    portal_ids = list(index.portal_ids[index.select(filters)[:max_items]])
+    for i in range(0, len(portal_ids), 500):
+        yield from load_portals(project_id, portal_ids[i:i + 500])
@@ -1,12 +1,28 @@
 import streamlit as st
-import requests
 import json
 import re
+from services.http import get_session
+from services import dify_cache
 
-def run_dify_workflow(api_key, inputs):
+# Domyślny czas życia zapamiętanych wyników workflow (secrets [DIFY] CACHE_TTL_SECONDS, 0 = wyłączone)
+DEFAULT_CACHE_TTL = 7 * 24 * 3600
+
+def _cache_ttl():
+    return int(st.secrets["DIFY"].get("CACHE_TTL_SECONDS", DEFAULT_CACHE_TTL))
+
+def run_dify_workflow(api_key, inputs, use_cache=True):
     """
     Uruchamia workflow w Twojej instancji Dify.
+    Udane wyniki zapamiętywane są w dify_cache pod hashem klucza workflow i znormalizowanych
+    wejść - powtórzone wywołanie z tymi samymi danymi nie odpytuje LLM.
     """
+    ttl = _cache_ttl() if use_cache else 0
+    if ttl > 0:
+        cache_key = dify_cache.make_key(api_key, inputs)
+        cached = dify_cache.lookup(cache_key)
+        if cached is not None:
+            return cached
+
     base_url = st.secrets["DIFY"].get("BASE_URL", "https://api.dify.ai/v1")
     url = f"{base_url}/workflows/run"
     api_user = st.secrets["DIFY"].get("API_USER", "webinvest")
@@ -23,15 +39,78 @@ def run_dify_workflow(api_key, inputs):
     }
     
     try:
-        response = requests.post(url, json=payload, headers=headers)
+        response = get_session("dify").post(url, json=payload, headers=headers)
         
         if response.status_code != 200:
             return {"error": response.status_code, "message": response.text}
             
-        return response.json()
+        result = response.json()
     except Exception as e:
         return {"error": "Exception", "message": str(e)}
 
+    # Zapamiętujemy tylko sukcesy - błąd ma być ponowiony przy następnym wywołaniu
+    if ttl > 0 and result.get('data', {}).get('status') == 'succeeded':
+        dify_cache.store(cache_key, result, ttl)
+    return result
+
+def stream_dify_workflow(api_key, inputs):
+    """
+    Uruchamia workflow w trybie streaming i zwraca generator zdarzeń SSE Dify
+    (workflow_started, node_started, node_finished, text_chunk, workflow_finished, ...).
+    Błędy HTTP/połączenia zwracane są jako zdarzenie {"event": "error", ...}.
+    """
+    base_url = st.secrets["DIFY"].get("BASE_URL", "https://api.dify.ai/v1")
+    url = f"{base_url}/workflows/run"
+    api_user = st.secrets["DIFY"].get("API_USER", "webinvest")
+
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+        "Accept": "text/event-stream"
+    }
+    
+    payload = {
+        "inputs": inputs,
+        "response_mode": "streaming",
+        "user": api_user
+    }
+
+    try:
+        response = get_session("dify").post(url, json=payload, headers=headers, stream=True)
+        with response:
+            if response.status_code != 200:
+                yield {"event": "error", "status": response.status_code, "message": response.text}
+                return
+            response.encoding = "utf-8"
+            data_lines = []
+            for line in response.iter_lines(decode_unicode=True):
+                if line:
+                    # Linie "event:" i komentarze keep-alive pomijamy - typ zdarzenia jest w JSON
+                    if line.startswith("data:"):
+                        data_lines.append(line[5:].lstrip())
+                    continue
+                if data_lines:
+                    yield json.loads("\n".join(data_lines))
+                    data_lines = []
+            if data_lines:
+                yield json.loads("\n".join(data_lines))
+    except Exception as e:
+        yield {"event": "error", "status": "Exception", "message": str(e)}
+
+def collect_workflow_stream(events, on_event=None):
+    """
+    Konsumuje zdarzenia ze stream_dify_workflow i składa wynik w formacie odpowiedzi blocking
+    ({"data": {"status", "outputs", ...}}). `on_event(event)` wołane dla każdego zdarzenia.
+    """
+    for event in events:
+        if on_event: on_event(event)
+        kind = event.get("event")
+        if kind == "workflow_finished":
+            return {"workflow_run_id": event.get("workflow_run_id"), "task_id": event.get("task_id"), "data": event.get("data", {})}
+        if kind == "error":
+            return {"error": event.get("status") or event.get("code"), "message": event.get("message")}
+    return {"error": "Incomplete", "message": "Strumień zakończył się bez workflow_finished"}
+
 def clean_and_parse_json(text):
     """
     Czyści odpowiedź LLM z markdowna i parsuje do JSON.
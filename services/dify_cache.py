@@ -0,0 +1,82 @@
+import json
+import re
+import time
+import zlib
+import random
+import hashlib
+from services import local_store
+
+DB_NAME = "dify_cache.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    response BLOB NOT NULL,
+    stored_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS results_expires ON results (expires_at);
+"""
+
+_WS = re.compile(r"\s+")
+
+
+def _conn():
+    return local_store.connect(DB_NAME, _SCHEMA)
+
+
+def normalize(value):
+    """Normalizacja wejść: białe znaki w tekstach zwinięte, None == "", klucze posortowane przy serializacji."""
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return _WS.sub(" ", value).strip()
+    if isinstance(value, dict):
+        return {str(k): normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize(v) for v in value]
+    return value
+
+
+def make_key(api_key, inputs):
+    """Odcisk wywołania workflow: hash klucza workflow + znormalizowanych wejść."""
+    payload = json.dumps([hashlib.sha256(api_key.encode()).hexdigest(), normalize(inputs)], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def lookup(key):
+    row = _conn().execute("SELECT response FROM results WHERE key = ? AND expires_at > ?", (key, time.time())).fetchone()
+    if row is None: return None
+    try:
+        response = json.loads(zlib.decompress(row['response']))
+    except (zlib.error, ValueError):
+        return None
+    _conn().execute("UPDATE results SET hits = hits + 1 WHERE key = ?", (key,))
+    return response
+
+
+def store(key, response, ttl):
+    now = time.time()
+    body = zlib.compress(json.dumps(response, ensure_ascii=False).encode("utf-8"), 6)
+    _conn().execute(
+        "INSERT OR REPLACE INTO results (key, response, stored_at, expires_at) VALUES (?, ?, ?, ?)",
+        (key, body, now, now + ttl)
+    )
+    if random.random() < 0.01:
+        purge()
+
+
+def purge():
+    return _conn().execute("DELETE FROM results WHERE expires_at < ?", (time.time(),)).rowcount
+
+
+def clear():
+    return _conn().execute("DELETE FROM results").rowcount
+
+
+def stats():
+    row = _conn().execute(
+        "SELECT COUNT(*) AS entries, COALESCE(SUM(LENGTH(response)), 0) AS bytes, COALESCE(SUM(hits), 0) AS hits FROM results"
+    ).fetchone()
+    return dict(row)
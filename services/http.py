@@ -0,0 +1,73 @@
+import threading
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+
+# Sesje są współdzielone w całym procesie (wszystkie sesje Streamlit i wątki robocze)
+_sessions = {}
+_lock = threading.Lock()
+
+DEFAULT_POOL = {"POOL_CONNECTIONS": 4, "POOL_MAXSIZE": 8, "POOL_BLOCK": True}
+
+
+def _pool_config(name):
+    """Ustawienia puli z secrets: [HTTP] (domyślne) i [HTTP.<NAME>] (per klient)."""
+    cfg = dict(DEFAULT_POOL)
+    try:
+        http_cfg = st.secrets.get("HTTP", {})
+    except Exception:
+        http_cfg = {}
+    cfg.update({k: v for k, v in http_cfg.items() if k in DEFAULT_POOL})
+    cfg.update(http_cfg.get(name.upper(), {}))
+    return cfg
+
+
+def get_session(name):
+    """
+    Zwraca procesową sesję requests z pulą keep-alive dla danego klienta (np. "whitepress", "dify").
+    POOL_MAXSIZE to limit połączeń per host; przy POOL_BLOCK wątki czekają na wolne połączenie.
+    """
+    session = _sessions.get(name)
+    if session is not None:
+        return session
+
+    with _lock:
+        if name not in _sessions:
+            cfg = _pool_config(name)
+            adapter = HTTPAdapter(
+                pool_connections=int(cfg["POOL_CONNECTIONS"]),
+                pool_maxsize=int(cfg["POOL_MAXSIZE"]),
+                pool_block=bool(cfg["POOL_BLOCK"]),
+                max_retries=0 # Ponowienia obsługują klienci (token bucket / backoff)
+            )
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update({"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"})
+            _sessions[name] = session
+    return _sessions[name]
+
+
+def pool_stats():
+    """
+    Statystyki pul połączeń: lista słowników (sesja, host, połączenia otwarte, zapytania, bezczynne).
+    """
+    stats = []
+    for name, session in list(_sessions.items()):
+        for prefix, adapter in session.adapters.items():
+            manager = getattr(adapter, "poolmanager", None)
+            if manager is None: continue
+            for key in list(manager.pools.keys()):
+                pool = manager.pools.get(key)
+                if pool is None: continue
+                stats.append({
+                    "session": name,
+                    "host": f"{pool.scheme}://{pool.host}:{pool.port}",
+                    "connections_opened": pool.num_connections,
+                    "requests": pool.num_requests,
+                    "idle": sum(1 for c in pool.pool.queue if c is not None) if pool.pool else 0,
+                    "maxsize": adapter._pool_maxsize,
+                })
+    # http:// i https:// mogą współdzielić adapter -> usuwamy duplikaty
+    unique = {(s["session"], s["host"]): s for s in stats}
+    return list(unique.values())
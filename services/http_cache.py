@@ -0,0 +1,103 @@
+import json
+import time
+import zlib
+import random
+import hashlib
+from services import local_store
+
+DB_NAME = "http_cache.sqlite"
+
+# Przeterminowane wpisy trzymamy jeszcze tyle czasu, żeby móc je rewalidować (ETag/Last-Modified)
+STALE_KEEP_SECONDS = 7 * 24 * 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    method TEXT NOT NULL,
+    url TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    body BLOB NOT NULL,
+    stored_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_expires ON responses (expires_at);
+"""
+
+
+def _conn():
+    return local_store.connect(DB_NAME, _SCHEMA)
+
+
+def make_key(method, url, params, credential):
+    """Klucz wpisu: metoda + URL + parametry + hash poświadczeń (różne konta nie dzielą odpowiedzi)."""
+    payload = json.dumps([method.upper(), url, params or {}, hashlib.sha256(credential.encode()).hexdigest()], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def lookup(key):
+    """Wpis z cache (także przeterminowany) albo None: data, etag, last_modified, fresh."""
+    row = _conn().execute("SELECT etag, last_modified, body, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+    if row is None: return None
+    try:
+        data = json.loads(zlib.decompress(row['body']))
+    except (zlib.error, ValueError):
+        return None
+    return {
+        "data": data,
+        "etag": row['etag'],
+        "last_modified": row['last_modified'],
+        "fresh": row['expires_at'] > time.time(),
+    }
+
+
+def conditional_headers(entry):
+    headers = {}
+    if entry and entry.get('etag'): headers["If-None-Match"] = entry['etag']
+    if entry and entry.get('last_modified'): headers["If-Modified-Since"] = entry['last_modified']
+    return headers
+
+
+def store(key, method, url, content, etag, last_modified, ttl):
+    """Zapisuje surowe ciało odpowiedzi (JSON) skompresowane zlib."""
+    now = time.time()
+    _conn().execute(
+        "INSERT OR REPLACE INTO responses (key, method, url, etag, last_modified, body, stored_at, expires_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (key, method.upper(), url, etag, last_modified, zlib.compress(content, 6), now, now + ttl)
+    )
+    if random.random() < 0.01:
+        purge()
+
+
+def touch(key, ttl):
+    """Po 304 Not Modified przedłuża ważność wpisu bez przesyłania treści."""
+    _conn().execute("UPDATE responses SET expires_at = ? WHERE key = ?", (time.time() + ttl, key))
+
+
+def expire_project(project_id):
+    """
+    Oznacza jako przeterminowane odpowiedzi projektu WhitePress (/v1/seeding/<id>...): kolejne
+    zapytanie rewaliduje je (ETag/Last-Modified) zamiast podawać z dysku. Zwraca liczbę wpisów.
+    """
+    pattern = f"%/v1/seeding/{project_id}"
+    return _conn().execute(
+        "UPDATE responses SET expires_at = ? WHERE expires_at > ? AND (url LIKE ? OR url LIKE ?)",
+        (time.time(), time.time(), pattern, pattern + "/%")
+    ).rowcount
+
+
+def expire_all():
+    return _conn().execute("UPDATE responses SET expires_at = ? WHERE expires_at > ?", (time.time(), time.time())).rowcount
+
+
+def purge(stale_keep=STALE_KEEP_SECONDS):
+    return _conn().execute("DELETE FROM responses WHERE expires_at < ?", (time.time() - stale_keep,)).rowcount
+
+
+def stats():
+    row = _conn().execute(
+        "SELECT COUNT(*) AS entries, COALESCE(SUM(LENGTH(body)), 0) AS bytes, "
+        "COALESCE(SUM(expires_at > ?), 0) AS fresh FROM responses", (time.time(),)
+    ).fetchone()
+    return dict(row)
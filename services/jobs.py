@@ -0,0 +1,244 @@
+import json
+import time
+import streamlit as st
+from datetime import datetime, timezone, timedelta
+from services import local_store
+
+ACTIVE_STATUSES = ("queued", "running")
+LEASE_EXHAUSTED = "Lease wygasł przy ostatniej próbie (worker przerwany)"
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pipeline_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    item_id INTEGER NOT NULL,
+    stage TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    payload TEXT NOT NULL DEFAULT '{}',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    run_after REAL NOT NULL,
+    lease_until REAL,
+    worker_id TEXT,
+    heartbeat_at REAL,
+    result TEXT,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pipeline_jobs_claim ON pipeline_jobs (status, run_after);
+CREATE INDEX IF NOT EXISTS pipeline_jobs_item ON pipeline_jobs (item_id, stage);
+"""
+
+
+def _now_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _chunks(values, size=200):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+class SupabaseJobStore:
+    """Kolejka w tabeli pipeline_jobs (sql/pipeline_jobs.sql); przejęcia i heartbeat przez RPC."""
+
+    def __init__(self, supabase):
+        self.supabase = supabase
+
+    def _table(self):
+        return self.supabase.table("pipeline_jobs")
+
+    def active_keys(self, item_ids):
+        keys = set()
+        for chunk in _chunks(list(item_ids)):
+            rows = self._table().select("item_id, stage").in_("item_id", chunk).in_("status", list(ACTIVE_STATUSES)).execute().data
+            keys.update((r['item_id'], r['stage']) for r in rows)
+        return keys
+
+    def enqueue(self, jobs, max_attempts=3):
+        """jobs: lista (item_id, stage, payload). Pomija pary (item, etap), które już czekają lub trwają."""
+        active = self.active_keys({j[0] for j in jobs})
+        rows = [
+            {"item_id": item_id, "stage": stage, "payload": payload or {}, "max_attempts": max_attempts}
+            for item_id, stage, payload in jobs if (item_id, stage) not in active
+        ]
+        added = 0
+        for chunk in _chunks(rows):
+            try:
+                self._table().insert(chunk).execute()
+                added += len(chunk)
+            except Exception:
+                # Wyścig z innym enqueue: indeks pipeline_jobs_active odrzuca duplikat, reszta wchodzi pojedynczo
+                for row in chunk:
+                    try:
+                        self._table().insert(row).execute()
+                        added += 1
+                    except Exception:
+                        pass
+        return added
+
+    def reap(self):
+        """Zadania z wygasłym lease po ostatniej próbie -> "error"; zwraca je (item_id, stage)."""
+        return self.supabase.rpc("reap_pipeline_jobs", {}).execute().data or []
+
+    def claim(self, worker_id, limit, lease_seconds, stages=None):
+        return self.supabase.rpc("claim_pipeline_jobs", {
+            "p_worker": worker_id, "p_limit": limit, "p_lease_seconds": lease_seconds, "p_stages": stages
+        }).execute().data or []
+
+    def heartbeat(self, job_id, worker_id, lease_seconds):
+        return bool(self.supabase.rpc("heartbeat_pipeline_job", {
+            "p_id": job_id, "p_worker": worker_id, "p_lease_seconds": lease_seconds
+        }).execute().data)
+
+    def complete(self, job_id, worker_id, result):
+        """Zamyka zadanie; False, jeśli worker nie ma już lease (zadanie przejął inny)."""
+        return bool(self._table().update({
+            "status": "done", "result": result, "lease_until": None, "updated_at": _now_iso()
+        }).eq("id", job_id).eq("worker_id", worker_id).eq("status", "running").execute().data)
+
+    def fail(self, job, worker_id, error, retry_delay):
+        retry = job['attempts'] < job['max_attempts']
+        run_after = (datetime.now(timezone.utc) + timedelta(seconds=retry_delay)).isoformat()
+        self._table().update({
+            "status": "queued" if retry else "error",
+            "last_error": str(error)[:2000],
+            "lease_until": None,
+            "run_after": run_after,
+            "updated_at": _now_iso()
+        }).eq("id", job['id']).eq("worker_id", worker_id).execute()
+        return retry
+
+    def jobs_for_items(self, item_ids):
+        rows = []
+        for chunk in _chunks(list(item_ids)):
+            rows.extend(self._table().select("id, item_id, stage, status, attempts, max_attempts, last_error, worker_id, updated_at").in_("item_id", chunk).order("id", desc=True).limit(1000).execute().data)
+        return rows
+
+
+class SqliteJobStore:
+    """Lokalny odpowiednik pipeline_jobs w SQLite (jeden host, wiele procesów)."""
+
+    def _conn(self):
+        return local_store.connect("jobs.sqlite", _SQLITE_SCHEMA)
+
+    def enqueue(self, jobs, max_attempts=3):
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            added = 0
+            for item_id, stage, payload in jobs:
+                exists = conn.execute(
+                    "SELECT 1 FROM pipeline_jobs WHERE item_id = ? AND stage = ? AND status IN ('queued', 'running')",
+                    (item_id, stage)
+                ).fetchone()
+                if exists: continue
+                conn.execute(
+                    "INSERT INTO pipeline_jobs (item_id, stage, payload, max_attempts, run_after, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (item_id, stage, json.dumps(payload or {}), max_attempts, now, now, now)
+                )
+                added += 1
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return added
+
+    def _row(self, row):
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'] or "{}")
+        return job
+
+    def reap(self):
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT * FROM pipeline_jobs WHERE status = 'running' AND lease_until < ? AND attempts >= max_attempts", (now,)
+            ).fetchall()
+            conn.execute(
+                "UPDATE pipeline_jobs SET status = 'error', last_error = ?, lease_until = NULL, updated_at = ? "
+                "WHERE status = 'running' AND lease_until < ? AND attempts >= max_attempts",
+                (LEASE_EXHAUSTED, now, now)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return [self._row(r) for r in rows]
+
+    def claim(self, worker_id, limit, lease_seconds, stages=None):
+        conn = self._conn()
+        now = time.time()
+        stage_sql = f" AND stage IN ({','.join('?' * len(stages))})" if stages else ""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            ids = [r['id'] for r in conn.execute(
+                "SELECT id FROM pipeline_jobs WHERE ((status = 'queued' AND run_after <= ?) "
+                "OR (status = 'running' AND lease_until < ? AND attempts < max_attempts))" + stage_sql + " ORDER BY run_after, id LIMIT ?",
+                [now, now] + list(stages or []) + [limit]
+            ).fetchall()]
+            for job_id in ids:
+                conn.execute(
+                    "UPDATE pipeline_jobs SET status = 'running', worker_id = ?, attempts = attempts + 1, "
+                    "lease_until = ?, heartbeat_at = ?, updated_at = ? WHERE id = ?",
+                    (worker_id, now + lease_seconds, now, now, job_id)
+                )
+            rows = conn.execute(
+                f"SELECT * FROM pipeline_jobs WHERE id IN ({','.join('?' * len(ids))})", ids
+            ).fetchall() if ids else []
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return [self._row(r) for r in rows]
+
+    def heartbeat(self, job_id, worker_id, lease_seconds):
+        now = time.time()
+        return self._conn().execute(
+            "UPDATE pipeline_jobs SET lease_until = ?, heartbeat_at = ?, updated_at = ? "
+            "WHERE id = ? AND worker_id = ? AND status = 'running'",
+            (now + lease_seconds, now, now, job_id, worker_id)
+        ).rowcount > 0
+
+    def complete(self, job_id, worker_id, result):
+        return self._conn().execute(
+            "UPDATE pipeline_jobs SET status = 'done', result = ?, lease_until = NULL, updated_at = ? "
+            "WHERE id = ? AND worker_id = ? AND status = 'running'",
+            (result, time.time(), job_id, worker_id)
+        ).rowcount > 0
+
+    def fail(self, job, worker_id, error, retry_delay):
+        retry = job['attempts'] < job['max_attempts']
+        now = time.time()
+        self._conn().execute(
+            "UPDATE pipeline_jobs SET status = ?, last_error = ?, lease_until = NULL, run_after = ?, updated_at = ? "
+            "WHERE id = ? AND worker_id = ?",
+            ("queued" if retry else "error", str(error)[:2000], now + retry_delay, now, job['id'], worker_id)
+        )
+        return retry
+
+    def jobs_for_items(self, item_ids):
+        item_ids = list(item_ids)
+        rows = []
+        for chunk in _chunks(item_ids):
+            rows.extend(self._conn().execute(
+                "SELECT id, item_id, stage, status, attempts, max_attempts, last_error, worker_id, updated_at "
+                f"FROM pipeline_jobs WHERE item_id IN ({','.join('?' * len(chunk))}) ORDER BY id DESC LIMIT 1000",
+                chunk
+            ).fetchall())
+        return [dict(r) for r in rows]
+
+
+def get_job_store(supabase):
+    """Backend kolejki z secrets [JOBS] BACKEND: "supabase" (domyślnie) albo "sqlite"."""
+    try:
+        backend = st.secrets.get("JOBS", {}).get("BACKEND", "supabase")
+    except Exception:
+        backend = "supabase"
+    if backend == "sqlite":
+        return SqliteJobStore()
+    return SupabaseJobStore(supabase)
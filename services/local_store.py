@@ -0,0 +1,46 @@
+import os
+import sqlite3
+import threading
+import streamlit as st
+
+_local = threading.local()
+
+
+def data_dir():
+    """
+    Katalog na lokalne bazy SQLite współdzielone przez wszystkie procesy na hoście.
+    Kolejność: zmienna LINKAI_DATA_DIR, secrets [STORAGE] DATA_DIR, ~/.cache/linkai.
+    """
+    path = os.environ.get("LINKAI_DATA_DIR")
+    if not path:
+        try:
+            path = st.secrets.get("STORAGE", {}).get("DATA_DIR")
+        except Exception:
+            path = None
+    path = path or os.path.join(os.path.expanduser("~"), ".cache", "linkai")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def connect(name, schema=""):
+    """
+    Zwraca połączenie SQLite (jedno na wątek i plik) w trybie WAL.
+    Przy pierwszym otwarciu wykonuje `schema` (CREATE TABLE IF NOT EXISTS ...).
+    """
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+
+    path = os.path.join(data_dir(), name)
+    conn = conns.get(path)
+    if conn is None:
+        # isolation_level=None -> transakcje sterujemy ręcznie (BEGIN IMMEDIATE)
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        if schema:
+            conn.executescript(schema)
+        conns[path] = conn
+    return conn
@@ -0,0 +1,68 @@
+import threading
+import streamlit as st
+from concurrent.futures import ThreadPoolExecutor
+from services.cache import offers_cache
+
+# Oferty trzymane w procesowym offers_cache pod kluczem (project_id, portal_id)
+_pending = {}
+_lock = threading.Lock()
+_executor = None
+
+
+def _key(project_id, portal_id):
+    return (str(project_id), str(portal_id))
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            workers = int(st.secrets["WHITEPRESS"].get("MAX_WORKERS", 4))
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="offers")
+        return _executor
+
+
+def get_cached(project_id, portal_id):
+    """Oferty z cache albo None, jeśli jeszcze nie zostały pobrane."""
+    return offers_cache.get(_key(project_id, portal_id))
+
+
+def _fetch(wp_api, key):
+    try:
+        offers = wp_api.get_portal_offers(*key)
+        # Pusta lista bywa skutkiem błędu API - trzymamy ją krócej
+        offers_cache.set(key, offers, ttl=None if offers else 60)
+        return offers
+    finally:
+        with _lock: _pending.pop(key, None)
+
+
+def prefetch(wp_api, project_id, portal_ids):
+    """Zleca w tle pobranie ofert dla portali, których nie ma w cache. Zwraca liczbę zleceń."""
+    executor = _get_executor()
+    submitted = 0
+    with _lock:
+        for pid in portal_ids:
+            key = _key(project_id, pid)
+            if key in offers_cache or key in _pending: continue
+            _pending[key] = executor.submit(_fetch, wp_api, key)
+            submitted += 1
+    return submitted
+
+
+def get_offers(wp_api, project_id, portal_id):
+    """Oferty portalu: z cache, z trwającego prefetchu albo pobrane od razu."""
+    key = _key(project_id, portal_id)
+    cached = offers_cache.get(key)
+    if cached is not None: return cached
+    with _lock:
+        future = _pending.get(key)
+    if future is not None:
+        return future.result()
+    return _fetch(wp_api, key)
+
+
+def progress(project_id, portal_ids):
+    """(pobrane, wszystkie) dla listy portali."""
+    done = sum(1 for pid in portal_ids if _key(project_id, pid) in offers_cache)
+    return done, len(portal_ids)
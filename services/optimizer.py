@@ -0,0 +1,208 @@
+import math
+import time
+import numpy as np
+
+# Wagi składowych wyniku dla strategii z campaign_gen ("count" premiuje liczbę portali)
+STRATEGY_WEIGHTS = {
+    "seo_trust_flow": {"tf": 0.5, "dr": 0.2, "uu": 0.15, "quality": 0.15, "count": 0.05},
+    "portal_score_domain_rating": {"dr": 0.5, "tf": 0.2, "uu": 0.15, "quality": 0.15, "count": 0.05},
+    "offer_price_min": {"count": 1.0, "tf": 0.05, "dr": 0.05},
+}
+
+
+def _column(candidates, key):
+    values = np.empty(len(candidates), dtype=np.float64)
+    for i, c in enumerate(candidates):
+        try: values[i] = float(c.get(key) or 0)
+        except (TypeError, ValueError): values[i] = 0.0
+    return values
+
+
+def composite_scores(candidates, weights):
+    """Wektorowy wynik ważony: TF/DR w skali 0-100, UU logarytmicznie, ocena jakości 0-10."""
+    tf = _column(candidates, 'portal_score_trust_flow') / 100.0
+    dr = _column(candidates, 'portal_score_domain_rating') / 100.0
+    uu = np.log1p(_column(candidates, 'portal_unique_users'))
+    uu = uu / uu.max() if uu.size and uu.max() > 0 else uu
+    quality = _column(candidates, 'portal_score_quality') / 10.0
+    return (
+        weights.get("tf", 0) * tf + weights.get("dr", 0) * dr + weights.get("uu", 0) * uu
+        + weights.get("quality", 0) * quality + weights.get("count", 0)
+    )
+
+
+def _knapsack_dp(weights, values, capacity, deadline):
+    """
+    0/1 knapsack na siatce całkowitej, wektorowo po wymiarze budżetu.
+    Decyzje trzymane jako spakowane bity (n x capacity / 8 bajtów). None po przekroczeniu czasu.
+    """
+    dp = np.zeros(capacity + 1, dtype=np.float64)
+    takes = []
+    for i, (w, v) in enumerate(zip(weights, values)):
+        if i % 64 == 0 and time.monotonic() > deadline:
+            return None
+        if w > capacity:
+            takes.append(None)
+            continue
+        cand = dp[:capacity + 1 - w] + v
+        take = cand > dp[w:]
+        dp[w:] = np.where(take, cand, dp[w:])
+        takes.append(np.packbits(take))
+
+    selected = []
+    c = int(np.argmax(dp))
+    for i in range(len(weights) - 1, -1, -1):
+        w = weights[i]
+        if takes[i] is None or c < w: continue
+        pos = c - w
+        if (takes[i][pos >> 3] >> (7 - (pos & 7))) & 1:
+            selected.append(i)
+            c -= w
+    return selected[::-1]
+
+
+def _greedy(prices, budget, order):
+    selected, spend = [], 0.0
+    for i in order:
+        if spend + prices[i] <= budget:
+            selected.append(i)
+            spend += prices[i]
+    return selected
+
+
+class _Constraints:
+    """Limity na grupy (kategoria/kraj) i minimalny udział dofollow dla zbioru wybranych indeksów."""
+
+    def __init__(self, group_keys, caps, dofollow, min_dofollow_share):
+        self.group_keys = group_keys or {}
+        self.caps = {k: v for k, v in (caps or {}).items() if v}
+        self.dofollow = dofollow
+        self.min_share = min_dofollow_share or 0.0
+
+    def counts(self, selected):
+        counts = {}
+        for name in self.caps:
+            c = counts.setdefault(name, {})
+            for i in selected:
+                for key in self.group_keys[name][i]:
+                    c[key] = c.get(key, 0) + 1
+        return counts
+
+    def fits(self, counts, i):
+        for name, cap in self.caps.items():
+            if any(counts[name].get(key, 0) + 1 > cap for key in self.group_keys[name][i]):
+                return False
+        return True
+
+    def add(self, counts, i):
+        for name in self.caps:
+            for key in self.group_keys[name][i]:
+                counts[name][key] = counts[name].get(key, 0) + 1
+
+    def share_ok(self, selected):
+        if not self.min_share or self.dofollow is None or len(selected) == 0: return True
+        return self.dofollow[np.asarray(selected)].mean() >= self.min_share - 1e-9
+
+
+def _refill(selected, prices, density, budget):
+    """Dopełnia budżet niewykorzystany przez zaokrąglenie cen w DP (najpierw najlepsze score/cena)."""
+    selected = list(selected)
+    chosen = set(selected)
+    spend = float(prices[selected].sum()) if selected else 0.0
+    for i in np.argsort(-density, kind="stable"):
+        i = int(i)
+        if density[i] <= 0 or i in chosen or spend + prices[i] > budget: continue
+        selected.append(i)
+        chosen.add(i)
+        spend += prices[i]
+    return selected
+
+
+def _repair(selected, prices, density, budget, cons):
+    """Usuwa najsłabsze (score/cena) portale łamiące limity, potem dopełnia budżet dopuszczalnymi."""
+    selected = sorted(selected, key=lambda i: -density[i])
+
+    # 1. Limity grup: zostawiamy najlepsze portale, które się mieszczą
+    kept, counts = [], {name: {} for name in cons.caps}
+    for i in selected:
+        if cons.fits(counts, i):
+            kept.append(i)
+            cons.add(counts, i)
+
+    # 2. Udział dofollow: zdejmujemy najsłabsze nofollow
+    if cons.dofollow is not None and cons.min_share:
+        while kept and not cons.share_ok(kept):
+            nofollow = [i for i in kept if not cons.dofollow[i]]
+            if not nofollow: break
+            kept.remove(nofollow[-1])
+        counts = cons.counts(kept)
+
+    # 3. Dopełnienie wolnego budżetu (najpierw dofollow, jeśli wymagany udział)
+    spend = float(prices[kept].sum()) if kept else 0.0
+    chosen = set(kept)
+    order = np.argsort(-density, kind="stable")
+    passes = [True, False] if cons.dofollow is not None and cons.min_share else [False]
+    for dofollow_only in passes:
+        for i in order:
+            i = int(i)
+            if density[i] <= 0 or i in chosen or spend + prices[i] > budget: continue
+            if dofollow_only and not cons.dofollow[i]: continue
+            if not cons.fits(counts, i): continue
+            if not cons.share_ok(kept + [i]): continue
+            kept.append(i)
+            chosen.add(i)
+            cons.add(counts, i)
+            spend += prices[i]
+    return kept
+
+
+def optimize_selection(prices, scores, budget, group_keys=None, caps=None, dofollow=None,
+                       min_dofollow_share=0.0, time_limit=1.0, max_cells=20000):
+    """
+    Wybiera portale maksymalizujące sumę `scores` przy sumie `prices` <= `budget`.
+
+    Rdzeń to dokładny knapsack DP na siatce cen (ceny zaokrąglane w górę do jednostki
+    budget/max_cells, więc wynik zawsze mieści się w budżecie; wolny budżet po zaokrągleniu
+    dopełniany jest zachłannie). Limity grup (`caps` na klucze
+    z `group_keys`, np. kategorie/kraj) oraz `min_dofollow_share` są egzekwowane naprawą
+    rozwiązania DP. Po przekroczeniu `time_limit` wynik liczony jest zachłannie wg score/cena.
+
+    Zwraca słownik: selected (indeksy), cost, score, method ("dp"/"greedy").
+    """
+    start = time.monotonic()
+    prices = np.asarray(prices, dtype=np.float64)
+    scores = np.asarray(scores, dtype=np.float64)
+    dofollow = None if dofollow is None else np.asarray(dofollow, dtype=bool)
+    valid = np.flatnonzero((prices > 0) & (prices <= budget) & (scores > 0))
+
+    density = np.zeros_like(scores)
+    density[valid] = scores[valid] / prices[valid]
+
+    unit = max(1.0, budget / max_cells)
+    capacity = int(math.floor(budget / unit))
+    weights = np.ceil(prices[valid] / unit).astype(np.int64)
+
+    picked = _knapsack_dp(weights, scores[valid], capacity, deadline=start + time_limit * 0.8)
+    method = "dp"
+    if picked is None:
+        method = "greedy"
+        order = valid[np.argsort(-density[valid], kind="stable")]
+        selected = _greedy(prices, budget, order)
+    else:
+        selected = [int(valid[i]) for i in picked]
+
+    cons = _Constraints(group_keys, caps, dofollow, min_dofollow_share)
+    if cons.caps or (dofollow is not None and min_dofollow_share):
+        # Naprawa kończy się własnym dopełnieniem budżetu z zachowaniem limitów
+        selected = _repair(selected, prices, density, budget, cons)
+    else:
+        selected = _refill(selected, prices, density, budget)
+
+    selected = sorted(selected, key=lambda i: -scores[i])
+    return {
+        "selected": selected,
+        "cost": float(prices[selected].sum()) if selected else 0.0,
+        "score": float(scores[selected].sum()) if selected else 0.0,
+        "method": method,
+        "elapsed": time.monotonic() - start,
+    }
@@ -0,0 +1,538 @@
+import time
+import queue
+import threading
+import streamlit as st
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from services.dify import run_dify_workflow, stream_dify_workflow, collect_workflow_stream, clean_and_parse_json
+from services.dify_cache import make_key
+from services.batch import BatchWriter
+
+# Etap -> kolumna statusu i klucz workflow Dify (w secrets [DIFY])
+STAGES = {
+    "research": {"status_col": "status_research", "workflow": "API_KEY_RESEARCH", "label": "Research"},
+    "structure": {"status_col": "status_structure", "workflow": "API_KEY_HEADERS", "label": "Struktura"},
+    "brief": {"status_col": "status_brief", "workflow": "API_KEY_BRIEF", "label": "Brief"},
+    "writing": {"status_col": "status_writing", "workflow": "API_KEY_WRITE", "label": "Pisanie"},
+}
+STAGE_ORDER = ["research", "structure", "brief", "writing"]
+
+
+def stage_concurrency(stage):
+    """Limit równoległych wywołań dla workflow etapu: [DIFY.CONCURRENCY] <KLUCZ> albo MAX_CONCURRENCY."""
+    cfg = st.secrets["DIFY"]
+    workflow = STAGES[stage]["workflow"]
+    per_key = cfg.get("CONCURRENCY", {})
+    return max(1, int(per_key.get(workflow, cfg.get("MAX_CONCURRENCY", 4))))
+
+
+_workflow_slots = {}
+_slots_lock = threading.Lock()
+
+
+def _workflow_slot(stage):
+    """
+    Procesowy semafor workflow etapu (stage_concurrency) - obejmuje wywołania z zagnieżdżonych
+    pul (np. sekcje w trybie równoległym), więc limit per workflow obowiązuje łącznie.
+    """
+    workflow = STAGES[stage]["workflow"]
+    with _slots_lock:
+        if workflow not in _workflow_slots:
+            _workflow_slots[workflow] = threading.BoundedSemaphore(stage_concurrency(stage))
+        return _workflow_slots[workflow]
+
+
+def _update(supabase, item_id, data, writer=None):
+    """Zapis zmian wiersza: od razu albo przez BatchWriter przebiegu (hurtowo, przy flush)."""
+    if writer is not None:
+        writer.add(item_id, data)
+        return
+    supabase.table("campaign_items").update(data).eq("id", item_id).execute()
+
+
+def _succeeded(res):
+    return res.get('data', {}).get('status') == 'succeeded'
+
+
+def _is_current(supabase, row, db_item, stage, fingerprint, writer=None):
+    """
+    Etap jest aktualny, jeśli ostatni udany przebieg miał identyczne wejścia (odcisk zapisany
+    w stage_fingerprints), a jego wynik jest w wierszu. Status nie ma znaczenia - w kolejce bywa
+    "queued"/"processing" - więc przy pominięciu przywracamy "done". Wiersz z `force` zawsze
+    jest przeliczany.
+    """
+    if row.get('force'): return False
+    fingerprints = db_item.get('stage_fingerprints') or {}
+    if fingerprints.get(stage) != fingerprint or not db_item.get(STAGE_OUTPUT_COLUMN[stage]): return False
+    status_col = STAGES[stage]["status_col"]
+    if db_item.get(status_col) != "done":
+        _update(supabase, row['id'], {status_col: "done"}, writer)
+    return True
+
+
+def _with_fingerprint(db_item, stage, fingerprint):
+    return {**(db_item.get('stage_fingerprints') or {}), stage: fingerprint}
+
+
+# Kolumna z wynikiem etapu - bez niej zgodny odcisk nie wystarcza do pominięcia
+STAGE_OUTPUT_COLUMN = {
+    "research": "keywords_serp",
+    "structure": "headings_final",
+    "brief": "content_brief",
+    "writing": "content_html",
+}
+
+# Pola, których etap potrzebuje z bazy (wyniki etapów poprzednich, własny wynik, status i odciski)
+STAGE_INPUT_COLUMNS = {
+    "research": ["keywords_serp", "status_research", "stage_fingerprints"],
+    "structure": ["keywords_serp", "info_graph", "headings_final", "status_structure", "stage_fingerprints"],
+    "brief": ["keywords_serp", "headings_final", "knowledge_graph", "info_graph", "content_brief", "status_brief", "stage_fingerprints"],
+    "writing": ["content_brief", "headings_final", "content_html", "status_writing", "stage_fingerprints"],
+}
+
+
+class StageInputs:
+    """
+    Dane wejściowe etapów dla wielu wierszy naraz: pobierane porcjami przez `in_("id", ...)`
+    do słownika id -> pola. Zmiany zapisywane przez BatchWriter przebiegu (on_add) trafiają
+    też tutaj, więc kolejne etapy łańcucha widzą wyniki poprzednich bez ponownego odczytu.
+    """
+
+    def __init__(self, supabase, chunk_size=200):
+        self.supabase = supabase
+        self.chunk_size = chunk_size
+        self._rows = {}
+        self._lock = threading.Lock()
+
+    def load(self, item_ids, stages):
+        columns = sorted({"id", *(c for stage in stages for c in STAGE_INPUT_COLUMNS[stage])})
+        item_ids = list(item_ids)
+        for i in range(0, len(item_ids), self.chunk_size):
+            rows = self.supabase.table("campaign_items").select(", ".join(columns)).in_("id", item_ids[i:i + self.chunk_size]).execute().data
+            with self._lock:
+                for row in rows:
+                    self._rows.setdefault(row['id'], {}).update(row)
+        return self
+
+    def get(self, item_id):
+        with self._lock:
+            row = self._rows.get(item_id)
+            return dict(row) if row is not None else None
+
+    def apply(self, item_id, data):
+        with self._lock:
+            if item_id in self._rows:
+                self._rows[item_id].update(data)
+
+
+def _stage_inputs(supabase, row, stage, inputs=None):
+    """Pola wejściowe etapu: z załadowanych StageInputs albo (np. w workerze) pojedynczym zapytaniem."""
+    if inputs is not None:
+        db_item = inputs.get(row['id'])
+        if db_item is not None: return db_item
+    return supabase.table("campaign_items").select(", ".join(STAGE_INPUT_COLUMNS[stage])).eq("id", row['id']).single().execute().data
+
+
+def research_item(supabase, row, emit=None, writer=None, inputs=None):
+    if not row['topic']: return "skipped"
+    api_key = st.secrets["DIFY"]["API_KEY_RESEARCH"]
+    payload = {
+        "keyword": row['topic'],
+        "language": row['language']
+    }
+    fingerprint = make_key(api_key, payload)
+    db_item = _stage_inputs(supabase, row, "research", inputs)
+    if _is_current(supabase, row, db_item, "research", fingerprint, writer): return "done"
+
+    _update(supabase, row['id'], {"status_research": "processing"}, writer)
+    res = run_dify_workflow(api_key, payload, use_cache=not row.get('force'))
+
+    if not _succeeded(res):
+        _update(supabase, row['id'], {"status_research": "error"}, writer)
+        return "error"
+
+    out = res['data']['outputs']
+    frazy_serp = out.get('frazy') or out.get('frazy z serp') or out.get('keywords') or row['topic']
+    frazy_senuto_val = out.get('frazy_senuto', '')
+    graf_info = out.get('grafinformacji') or out.get('graf') or out.get('information_graph') or ""
+    graf_know = out.get('knowledge_graph') or out.get('graf wiedzy') or ""
+
+    _update(supabase, row['id'], {
+        "keywords_serp": frazy_serp,
+        "frazy_senuto": frazy_senuto_val,
+        "info_graph": graf_info,
+        "knowledge_graph": graf_know,
+        "stage_fingerprints": _with_fingerprint(db_item, "research", fingerprint),
+        "status_research": "done",       # Update granular
+        "pipeline_status": "researched"  # Keep legacy for compatibility
+    }, writer)
+    return "done"
+
+
+def structure_item(supabase, row, emit=None, writer=None, inputs=None):
+    db_item = _stage_inputs(supabase, row, "structure", inputs)
+    frazy_val = db_item.get('keywords_serp') or row['topic']
+    graf_val = db_item.get('info_graph') or "Brak danych"
+
+    api_key = st.secrets["DIFY"]["API_KEY_HEADERS"]
+    payload = {
+        "keyword": row['topic'],
+        "language": row['language'],
+        "frazy": frazy_val,
+        "graf": graf_val
+    }
+    fingerprint = make_key(api_key, payload)
+    if _is_current(supabase, row, db_item, "structure", fingerprint, writer): return "done"
+
+    _update(supabase, row['id'], {"status_structure": "processing"}, writer)
+    res = run_dify_workflow(api_key, payload, use_cache=not row.get('force'))
+
+    if not _succeeded(res):
+        _update(supabase, row['id'], {"status_structure": "error"}, writer)
+        return "error"
+
+    out = res['data']['outputs']
+    extended = out.get('naglowki_rozbudowane', '')
+    _update(supabase, row['id'], {
+        "headings_extended": extended,
+        "headings_h2": out.get('naglowki_h2'),
+        "headings_questions": out.get('naglowki_pytania'),
+        "headings_final": extended,
+        "stage_fingerprints": _with_fingerprint(db_item, "structure", fingerprint),
+        "status_structure": "done",
+        "pipeline_status": "structured"
+    }, writer)
+    return "done"
+
+
+def brief_item(supabase, row, emit=None, writer=None, inputs=None):
+    db_item = _stage_inputs(supabase, row, "brief", inputs)
+    if not db_item.get('headings_final'):
+        # Brak struktury - etap nie może ruszyć, wracamy do "pending"
+        _update(supabase, row['id'], {"status_brief": "pending"}, writer)
+        return "skipped"
+
+    keywords_input = db_item.get('keywords_serp') or row['topic']
+
+    api_key = st.secrets["DIFY"]["API_KEY_BRIEF"]
+    payload = {
+        "keywords": keywords_input,
+        "headings": db_item.get('headings_final', ''),
+        "knowledge_graph": db_item.get('knowledge_graph', 'Brak'),
+        "information_graph": db_item.get('info_graph', 'Brak'),
+        "keyword": row['topic']
+    }
+    fingerprint = make_key(api_key, payload)
+    if _is_current(supabase, row, db_item, "brief", fingerprint, writer): return "done"
+
+    _update(supabase, row['id'], {"status_brief": "processing"}, writer)
+    res = run_dify_workflow(api_key, payload, use_cache=not row.get('force'))
+
+    parsed = clean_and_parse_json(res['data']['outputs'].get('brief', '[]')) if _succeeded(res) else None
+    if not parsed:
+        _update(supabase, row['id'], {"status_brief": "error"}, writer)
+        return "error"
+
+    _update(supabase, row['id'], {
+        "content_brief": parsed,
+        "stage_fingerprints": _with_fingerprint(db_item, "brief", fingerprint),
+        "status_brief": "done",
+        "pipeline_status": "briefed"
+    }, writer)
+    return "done"
+
+
+WRITING_MODES = ("sequential", "parallel")
+
+# Limit długości streszczenia wcześniejszych sekcji przekazywanego jako "done" w trybie równoległym
+SUMMARY_CHARS = 1500
+
+
+def _section_inputs(row, db_item, section, done):
+    return {
+        "naglowek": section.get('heading'),
+        "knowledge": section.get('knowledge'),
+        "keywords": section.get('keywords'),
+        "language": row['language'],
+        "headings": db_item.get('headings_final'),
+        "done": done,
+        "keyword": row['topic'],
+        "instruction": row['extra_instructions'] or ""
+    }
+
+
+def _section_text(res, partial=""):
+    outputs = res['data']['outputs']
+    return outputs.get('result') or outputs.get('text', '') or partial
+
+
+def _write_sequential(supabase, row, db_item, api_key, emit, writer=None):
+    """
+    Sekcja po sekcji w trybie streaming; każda dostaje całą dotychczasową treść jako "done".
+    Zwraca None, jeśli któraś sekcja się nie udała (napisane zostają zapisane w content).
+    """
+    failed = False
+    full_content = ""
+    for section in db_item['content_brief']:
+        partial = []
+        last_emit = [0.0]
+
+        def on_event(event):
+            if event.get("event") == "text_chunk":
+                partial.append(event.get("data", {}).get("text", ""))
+                # Ograniczamy częstotliwość odświeżania podglądu
+                if emit and time.monotonic() - last_emit[0] > 0.3:
+                    last_emit[0] = time.monotonic()
+                    emit("text", full_content + "".join(partial))
+            elif event.get("event") == "node_started" and emit:
+                emit("node", event.get("data", {}).get("title", ""))
+
+        with _workflow_slot("writing"):
+            res = collect_workflow_stream(stream_dify_workflow(api_key, _section_inputs(row, db_item, section, full_content)), on_event=on_event)
+        if _succeeded(res):
+            full_content += _section_text(res, "".join(partial)) + "\n\n"
+            if emit: emit("text", full_content)
+            # Zapis częściowy - treść nie ginie, jeśli przebieg zostanie przerwany
+            _update(supabase, row['id'], {"content": full_content}, writer)
+        else:
+            failed = True
+    return None if failed else full_content
+
+
+def rolling_summary(brief, index, limit=SUMMARY_CHARS):
+    """
+    Streszczenie sekcji poprzedzających `index`, zbudowane z briefu (nagłówek + początek wiedzy),
+    od najbliższej wstecz, aż do `limit` znaków. Zastępuje pełną treść w trybie równoległym.
+    """
+    lines = []
+    used = 0
+    for section in reversed(brief[:index]):
+        knowledge = " ".join(str(section.get('knowledge') or "").split())
+        line = f"- {section.get('heading', '')}: {knowledge[:200]}".rstrip(": ")
+        if used + len(line) > limit: break
+        lines.append(line)
+        used += len(line) + 1
+    if not lines: return ""
+    return "Wcześniejsze sekcje artykułu (omówione, nie powtarzaj):\n" + "\n".join(reversed(lines))
+
+
+def _stitch(row, db_item, sections):
+    """
+    Końcowe ujednolicenie: workflow API_KEY_STITCH (jeśli skonfigurowany) dostaje złożony tekst;
+    bez niego albo przy błędzie sekcje są po prostu łączone.
+    """
+    joined = "\n\n".join(sections) + "\n\n"
+    stitch_key = st.secrets["DIFY"].get("API_KEY_STITCH")
+    if not stitch_key: return joined
+    res = run_dify_workflow(stitch_key, {
+        "content": joined,
+        "keyword": row['topic'],
+        "language": row['language'],
+        "headings": db_item.get('headings_final'),
+        "instruction": row['extra_instructions'] or ""
+    }, use_cache=not row.get('force'))
+    if not _succeeded(res): return joined
+    return _section_text(res, joined)
+
+
+def _write_parallel(supabase, row, db_item, api_key, emit, writer=None):
+    """
+    Sekcje pisane równolegle ([DIFY] SECTION_CONCURRENCY, w ramach wspólnego _workflow_slot),
+    każda z ograniczonym streszczeniem poprzednich zamiast pełnej treści, a na końcu jeden
+    przebieg zszywający. Zwraca None, jeśli któraś sekcja się nie udała.
+    """
+    brief = db_item['content_brief']
+    cfg = st.secrets["DIFY"]
+    workers = max(1, int(cfg.get("SECTION_CONCURRENCY", 4)))
+    texts = [None] * len(brief)
+
+    def draft(i):
+        with _workflow_slot("writing"):
+            res = run_dify_workflow(api_key, _section_inputs(row, db_item, brief[i], rolling_summary(brief, i)), use_cache=not row.get('force'))
+        return _section_text(res) if _succeeded(res) else None
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(brief)), thread_name_prefix=f"sections-{row['id']}") as executor:
+        futures = {executor.submit(draft, i): i for i in range(len(brief))}
+        done = 0
+        for future in as_completed(futures):
+            try: texts[futures[future]] = future.result()
+            except Exception: pass
+            done += 1
+            if emit:
+                emit("node", f"Sekcje {done}/{len(brief)}")
+                emit("text", "\n\n".join(t for t in texts if t))
+
+    sections = [t for t in texts if t]
+    if not sections: return None
+    # Szkic zapisany przed zszyciem - nie ginie, jeśli ostatni krok (albo sekcja) zawiedzie
+    _update(supabase, row['id'], {"content": "\n\n".join(sections) + "\n\n"}, writer)
+    if len(sections) < len(brief): return None
+    if emit: emit("node", "Zszywanie")
+    return _stitch(row, db_item, sections)
+
+
+def writing_item(supabase, row, emit=None, writer=None, inputs=None):
+    """
+    Pisze artykuł z briefu. Tryb `row['writing_mode']`: "sequential" (domyślny) - sekcja po sekcji
+    w trybie streaming, z podglądem na żywo i zapisem po każdej sekcji; "parallel" - sekcje
+    równolegle, z ograniczonym streszczeniem poprzednich i końcowym zszyciem.
+    """
+    db_item = _stage_inputs(supabase, row, "writing", inputs)
+    brief = db_item.get('content_brief')
+    if not brief:
+        _update(supabase, row['id'], {"status_writing": "pending"}, writer)
+        return "skipped"
+
+    mode = row.get('writing_mode') or "sequential"
+    api_key = st.secrets["DIFY"]["API_KEY_WRITE"]
+    fingerprint = make_key(api_key, {
+        "brief": brief,
+        "headings": db_item.get('headings_final'),
+        "language": row['language'],
+        "keyword": row['topic'],
+        "instruction": row['extra_instructions'] or "",
+        **({"mode": mode} if mode != "sequential" else {})
+    })
+    if _is_current(supabase, row, db_item, "writing", fingerprint, writer): return "done"
+
+    _update(supabase, row['id'], {"status_writing": "processing"}, writer)
+
+    write = _write_parallel if mode == "parallel" else _write_sequential
+    full_content = write(supabase, row, db_item, api_key, emit, writer)
+    if full_content is None:
+        # Brakujące sekcje - artykuł niekompletny, nie oznaczamy go jako napisanego
+        _update(supabase, row['id'], {"status_writing": "error"}, writer)
+        return "error"
+
+    _update(supabase, row['id'], {
+        "content_html": full_content,
+        "content": full_content,
+        "stage_fingerprints": _with_fingerprint(db_item, "writing", fingerprint),
+        "status_writing": "done",
+        "pipeline_status": "content_ready",
+        "status": "content_ready"
+    }, writer)
+    return "done"
+
+
+STAGE_FUNCS = {
+    "research": research_item,
+    "structure": structure_item,
+    "brief": brief_item,
+    "writing": writing_item,
+}
+
+
+def _drain(events, on_event):
+    """Przekazuje zdarzenia z wątków roboczych do `on_event` w wątku wywołującym."""
+    while True:
+        try: item_id, kind, payload = events.get_nowait()
+        except queue.Empty: return
+        if on_event: on_event(item_id, kind, payload)
+
+
+def run_stage(supabase, stage, rows, on_progress=None, on_event=None):
+    """
+    Uruchamia etap dla wielu wierszy na ograniczonej puli wątków (limit per workflow Dify).
+    Błąd jednego wiersza nie przerywa pozostałych - wiersz dostaje status "error".
+    `on_progress(done, total, item_id, result)` i `on_event(item_id, kind, payload)` (np. tekst
+    pisany na żywo) wołane są w wątku wywołującym, więc mogą aktualizować widżety Streamlit.
+    Zmiany wierszy (statusy, wyniki) zbiera BatchWriter i zapisuje hurtowo co takt pętli.
+    Zwraca słownik item_id -> "done" / "error" / "skipped".
+    """
+    func = STAGE_FUNCS[stage]
+    status_col = STAGES[stage]["status_col"]
+    events = queue.Queue()
+    inputs = StageInputs(supabase).load([row['id'] for row in rows], [stage])
+    writer = BatchWriter(supabase, "campaign_items", on_add=inputs.apply)
+    results = {}
+    # Nieudane zapisy zbierane przez cały przebieg - wiersz może skończyć już po flush, w którym zawiódł
+    failed = set()
+
+    def emitter(item_id):
+        return lambda kind, payload: events.put((item_id, kind, payload))
+
+    with ThreadPoolExecutor(max_workers=stage_concurrency(stage), thread_name_prefix=f"stage-{stage}") as executor:
+        futures = {executor.submit(func, supabase, row, emitter(row['id']), writer, inputs): row['id'] for row in rows}
+        pending = set(futures)
+        while pending:
+            finished, pending = wait(pending, timeout=0.25, return_when=FIRST_COMPLETED)
+            _drain(events, on_event)
+            # Zakończone wiersze mają już wszystkie zmiany w writerze
+            failed |= writer.flush()
+            for future in finished:
+                item_id = futures[future]
+                try:
+                    results[item_id] = "error" if item_id in failed else future.result()
+                except Exception:
+                    results[item_id] = "error"
+                    _update(supabase, item_id, {status_col: "error"}, writer)
+                if on_progress: on_progress(len(results), len(futures), item_id, results[item_id])
+    _drain(events, on_event)
+    for item_id in writer.flush():
+        results[item_id] = "error"
+    return results
+
+
+def run_chains(supabase, rows, stages=None, on_progress=None, on_event=None):
+    """
+    Auto-pilot: każdy wiersz przechodzi łańcuch etapów (domyślnie research -> structure ->
+    brief -> writing) niezależnie od pozostałych. Każdy etap ma własną pulę (limit per
+    workflow Dify), więc brief artykułu A biegnie równolegle z researchem artykułu B.
+    Łańcuch wiersza zatrzymuje się na pierwszym wyniku innym niż "done".
+    `on_progress(done, total, item_id, stage, result)` wołane jest po każdym etapie,
+    `on_event(item_id, kind, payload)` jak w run_stage - oba w wątku wywołującym.
+    Zwraca słownik item_id -> {etap: wynik}.
+    """
+    stages = list(stages or STAGE_ORDER)
+    events = queue.Queue()
+    # Wejścia wszystkich etapów ładowane raz; wyniki etapów uzupełniają je przez writer
+    inputs = StageInputs(supabase).load([row['id'] for row in rows], stages)
+    writer = BatchWriter(supabase, "campaign_items", on_add=inputs.apply)
+    results = {row['id']: {} for row in rows}
+    total = len(rows) * len(stages)
+    executors = {
+        stage: ThreadPoolExecutor(max_workers=stage_concurrency(stage), thread_name_prefix=f"chain-{stage}")
+        for stage in stages
+    }
+    futures = {}
+    done_count = 0
+    failed = set()
+
+    def submit(row, idx):
+        stage = stages[idx]
+        emit = lambda kind, payload, item_id=row['id']: events.put((item_id, kind, payload))
+        futures[executors[stage].submit(STAGE_FUNCS[stage], supabase, row, emit, writer, inputs)] = (row, idx)
+
+    try:
+        for row in rows: submit(row, 0)
+        pending = set(futures)
+        while pending:
+            finished, pending = wait(pending, timeout=0.25, return_when=FIRST_COMPLETED)
+            _drain(events, on_event)
+            # Wyniki etapu muszą być w bazie, zanim kolejny etap je odczyta
+            failed |= writer.flush()
+            for future in finished:
+                row, idx = futures.pop(future)
+                stage = stages[idx]
+                try:
+                    result = "error" if row['id'] in failed else future.result()
+                except Exception:
+                    result = "error"
+                    _update(supabase, row['id'], {STAGES[stage]["status_col"]: "error"}, writer)
+                results[row['id']][stage] = result
+                done_count += 1
+                if result == "done" and idx + 1 < len(stages):
+                    submit(row, idx + 1)
+                else:
+                    # Pominięte etapy liczymy jako zakończone, żeby postęp doszedł do 100%
+                    done_count += len(stages) - idx - 1
+                if on_progress: on_progress(done_count, total, row['id'], stage, result)
+            pending = set(futures)
+        _drain(events, on_event)
+        for item_id in writer.flush():
+            # Ostatni wykonany etap wiersza nie został zapisany
+            if results.get(item_id): results[item_id][list(results[item_id])[-1]] = "error"
+    finally:
+        for executor in executors.values():
+            executor.shutdown(wait=True, cancel_futures=True)
+    return results
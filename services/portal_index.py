@@ -0,0 +1,118 @@
+import numpy as np
+
+# Filtry zakresowe z render_filters_form: klucz -> (kolumna numeryczna, operator)
+RANGE_FILTERS = {
+    "price_min": ("best_price", ">="),
+    "price_max": ("best_price", "<="),
+    "min_dr": ("dr", ">="),
+    "min_tf": ("tf", ">="),
+    "min_traffic": ("uu", ">="),
+}
+# Filtry zbiorowe: klucz -> kolumna kategoryczna (dopasowanie "dowolna z wartości")
+SET_FILTERS = {
+    "categories": "categories",
+    "portal_type": "portal_type",
+    "portal_country": "portal_country",
+    "portal_region": "portal_region",
+    "portal_quality": "portal_quality",
+    "offer_dofollow": "offer_dofollow",
+    "offer_link_type": "offer_link_type",
+    "offer_persistence": "offer_persistence",
+    "offer_tagging": "offer_tagging",
+}
+FALSY_VALUES = ("0", "False")
+
+
+def active_filters(filters):
+    """Zostawia tylko filtry, które faktycznie coś zawężają (pomija "All", puste i zera)."""
+    active = {}
+    for key, value in (filters or {}).items():
+        if value in (None, "", "All", [], False, 0): continue
+        active[key] = value
+    return active
+
+
+def _build_bitset(rows):
+    """rows: lista list wartości (str) -> (słownik wartość->bit, macierz uint64 n x words)."""
+    vocab = {}
+    row_idx, bit_idx = [], []
+    for i, values in enumerate(rows):
+        for v in values:
+            row_idx.append(i)
+            bit_idx.append(vocab.setdefault(v, len(vocab)))
+    words = max(1, -(-len(vocab) // 64))
+    bits = np.zeros((len(rows), words), dtype=np.uint64)
+    if row_idx:
+        bit_idx = np.asarray(bit_idx, dtype=np.uint64)
+        np.bitwise_or.at(
+            bits,
+            (np.asarray(row_idx), (bit_idx // 64).astype(np.intp)),
+            np.left_shift(np.uint64(1), bit_idx % np.uint64(64))
+        )
+    return vocab, bits
+
+
+class PortalIndex:
+    """
+    Kolumnowy indeks portali jednego snapshotu katalogu.
+    Filtry z render_filters_form są liczone maskami NumPy, pola wielowartościowe trzymane jako bitsety.
+    """
+
+    def __init__(self, portal_ids, numeric, categorical, urls):
+        self.portal_ids = np.asarray(portal_ids, dtype=object)
+        self.size = len(self.portal_ids)
+        # NaN oznacza brak wartości - porównania z NaN odrzucają wiersz, tak jak filtr API
+        self.numeric = {k: np.asarray(v, dtype=np.float64) for k, v in numeric.items()}
+        self.urls = np.asarray([(u or "").lower() for u in urls], dtype=str)
+        self.bitsets = {k: _build_bitset(v) for k, v in categorical.items()}
+
+    def _any_of(self, column, values):
+        vocab, bits = self.bitsets[column]
+        query = np.zeros(bits.shape[1], dtype=np.uint64)
+        for v in values:
+            bit = vocab.get(str(v))
+            if bit is not None:
+                query[bit // 64] |= np.uint64(1) << np.uint64(bit % 64)
+        return (bits & query).any(axis=1)
+
+    def mask(self, filters):
+        """Maska bool wierszy spełniających filtry."""
+        mask = np.ones(self.size, dtype=bool)
+        f = active_filters(filters)
+        for key, (column, op) in RANGE_FILTERS.items():
+            if key not in f: continue
+            col = self.numeric[column]
+            mask &= (col >= float(f[key])) if op == ">=" else (col <= float(f[key]))
+        for key, column in SET_FILTERS.items():
+            if key not in f: continue
+            values = f[key] if isinstance(f[key], (list, tuple, set)) else [f[key]]
+            mask &= self._any_of(column, values)
+        if 'only_promo' in f:
+            vocab, _ = self.bitsets["offer_promo"]
+            mask &= self._any_of("offer_promo", [v for v in vocab if v not in FALSY_VALUES])
+        if 'portal_url' in f:
+            mask &= np.char.find(self.urls, str(f['portal_url']).lower()) >= 0
+        return mask
+
+    def select(self, filters, sort=None, descending=True):
+        """Indeksy wierszy spełniających filtry, w kolejności snapshotu albo wg kolumny `sort`."""
+        idx = np.flatnonzero(self.mask(filters))
+        if sort in self.numeric and idx.size:
+            values = self.numeric[sort][idx]
+            # Braki na końcu niezależnie od kierunku, sortowanie stabilne względem pozycji
+            key = np.where(np.isnan(values), -np.inf if descending else np.inf, values)
+            order = np.argsort(-key if descending else key, kind="stable")
+            idx = idx[order]
+        return idx
+
+    def page(self, filters, page=1, per_page=20, sort=None, descending=True):
+        """Zwraca (portal_ids strony, meta) w formacie meta z WhitePressAPI.search_portals."""
+        idx = self.select(filters, sort=sort, descending=descending)
+        total = int(idx.size)
+        start = (page - 1) * per_page
+        meta = {
+            "total_items": total,
+            "total_pages": max(1, -(-total // per_page)),
+            "current_page": page,
+        }
+        return list(self.portal_ids[idx[start:start + per_page]]), meta
@@ -0,0 +1,129 @@
+"""
+Synchronizacja projektów WhitePress -> tabela clients na podstawie różnic.
+
+Uruchomienie bez interfejsu (np. z crona, z katalogu aplikacji):
+    python -m services.project_sync
+    python -m services.project_sync --prune --dry-run
+"""
+import logging
+import argparse
+import streamlit as st
+
+logger = logging.getLogger(__name__)
+
+SYNC_FIELDS = ("name", "website")
+CHUNK_SIZE = 500
+PAGE_SIZE = 1000
+
+
+def project_record(project):
+    """Projekt z API -> wiersz clients (bez id) albo None, jeśli projekt nie ma id."""
+    project_id = project.get('id')
+    if not project_id: return None
+    return {
+        "wp_project_id": project_id,
+        "name": project.get('title', project.get('name', 'Projekt bez nazwy')),
+        "website": project.get('url', '')
+    }
+
+
+def load_clients(supabase):
+    """Istniejący klienci jako {str(wp_project_id): wiersz}, pobierani stronami."""
+    clients = {}
+    start = 0
+    while True:
+        rows = supabase.table("clients").select("id, wp_project_id, name, website").order("id").range(start, start + PAGE_SIZE - 1).execute().data
+        for row in rows:
+            if row.get('wp_project_id') is not None:
+                clients[str(row['wp_project_id'])] = row
+        if len(rows) < PAGE_SIZE: return clients
+        start += PAGE_SIZE
+
+
+def plan_sync(existing, projects, prune=False):
+    """
+    Wylicza zmiany lokalnie: nowe projekty, projekty ze zmienioną nazwą/adresem, a przy `prune`
+    klientów, których projektów nie ma już w WhitePress. Zwraca słownik list + liczbę bez zmian.
+    """
+    inserts, updates, seen = [], [], set()
+    for project in projects:
+        record = project_record(project)
+        if record is None: continue
+        key = str(record['wp_project_id'])
+        if key in seen: continue
+        seen.add(key)
+        current = existing.get(key)
+        if current is None:
+            inserts.append(record)
+        elif any((current.get(f) or "") != (record[f] or "") for f in SYNC_FIELDS):
+            updates.append(record)
+    deletes = sorted((k for k in existing if k not in seen), key=str) if prune and seen else []
+    return {
+        "insert": inserts,
+        "update": updates,
+        "delete": deletes,
+        "unchanged": len(seen) - len(inserts) - len(updates),
+    }
+
+
+def apply_plan(supabase, plan, chunk_size=CHUNK_SIZE):
+    """Zapisuje plan porcjami: upsert po wp_project_id dla nowych i zmienionych, delete().in_() dla usuniętych."""
+    errors = []
+    rows = plan['insert'] + plan['update']
+    for i in range(0, len(rows), chunk_size):
+        chunk = rows[i:i + chunk_size]
+        try:
+            supabase.table("clients").upsert(chunk, on_conflict="wp_project_id").execute()
+        except Exception as e:
+            errors.append(f"upsert {i}-{i + len(chunk)}: {e}")
+    for i in range(0, len(plan['delete']), chunk_size):
+        chunk = plan['delete'][i:i + chunk_size]
+        try:
+            supabase.table("clients").delete().in_("wp_project_id", chunk).execute()
+        except Exception as e:
+            # Najczęściej klient ma jeszcze kampanie (klucz obcy)
+            errors.append(f"delete {len(chunk)}: {e}")
+    return errors
+
+
+def sync_projects(supabase, wp_api, prune=False, dry_run=False):
+    """
+    Pełna synchronizacja. Zwraca raport: plan + liczba projektów z API + błędy.
+    Przy `prune` lista projektów musi być kompletna - inaczej usunięcia są pomijane.
+    """
+    errors, projects = [], []
+    try:
+        for project in wp_api.iter_projects(strict=prune):
+            projects.append(project)
+    except RuntimeError as e:
+        # Niepełna lista oznaczałaby usunięcie klientów z brakujących stron; pobrane strony zapisujemy
+        errors.append(f"Niepełna lista projektów, usuwanie pominięte: {e}")
+        prune = False
+    plan = plan_sync(load_clients(supabase), projects, prune=prune)
+    if not dry_run: errors += apply_plan(supabase, plan)
+    return {**plan, "projects": len(projects), "errors": errors, "dry_run": dry_run}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synchronizacja projektów WhitePress do tabeli clients")
+    parser.add_argument("--prune", action="store_true", help="Usuń klientów, których projektów nie ma w WhitePress")
+    parser.add_argument("--dry-run", action="store_true", help="Tylko pokaż zmiany, bez zapisu")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    from supabase import create_client
+    from services.whitepress import WhitePressAPI
+    supabase = create_client(st.secrets["SUPABASE"]["URL"], st.secrets["SUPABASE"]["KEY"])
+    report = sync_projects(supabase, WhitePressAPI(), prune=args.prune, dry_run=args.dry_run)
+    logger.info(
+        "Projekty: %d | nowe: %d | zmienione: %d | usunięte: %d | bez zmian: %d%s",
+        report['projects'], len(report['insert']), len(report['update']), len(report['delete']),
+        report['unchanged'], " (dry run)" if report['dry_run'] else ""
+    )
+    for error in report['errors']:
+        logger.error(error)
+    return 1 if report['errors'] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
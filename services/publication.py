@@ -0,0 +1,181 @@
+import hashlib
+import logging
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from services.batch import BatchWriter
+
+logger = logging.getLogger(__name__)
+
+PUBLISHED = {"pipeline_status": "published", "status": "published"}
+CHUNK_SIZE = 200
+
+
+def idempotency_key(item):
+    """
+    Stały klucz zlecenia publikacji artykułu na portalu (rejestr publication_attempts).
+    API WhitePress nie deduplikuje zleceń, więc klucz nie chroni przed podwójną wysyłką.
+    """
+    return hashlib.sha256(f"linkai:{item['id']}:{item.get('wp_portal_id')}".encode()).hexdigest()[:32]
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def project_ids_for_campaigns(supabase, campaign_ids):
+    """{campaign_id: wp_project_id} przez campaigns -> clients."""
+    result = {}
+    campaign_ids = [c for c in set(campaign_ids) if c is not None]
+    for i in range(0, len(campaign_ids), CHUNK_SIZE):
+        rows = supabase.table("campaigns").select("id, clients(wp_project_id)").in_("id", campaign_ids[i:i + CHUNK_SIZE]).execute().data
+        for row in rows:
+            result[row['id']] = (row.get('clients') or {}).get('wp_project_id')
+    return result
+
+
+def load_attempts(supabase, item_ids):
+    """{item_id: wiersz publication_attempts} dla podanych artykułów."""
+    attempts = {}
+    item_ids = list(item_ids)
+    for i in range(0, len(item_ids), CHUNK_SIZE):
+        rows = supabase.table("publication_attempts").select("*").in_("item_id", item_ids[i:i + CHUNK_SIZE]).execute().data
+        attempts.update({r['item_id']: r for r in rows})
+    return attempts
+
+
+def _norm(value):
+    value = str(value or "").strip().lower()
+    for prefix in ("https://", "http://", "www."):
+        if value.startswith(prefix): value = value[len(prefix):]
+    return value.rstrip("/")
+
+
+def _ordered(item, articles):
+    """Zlecenie projektu odpowiadające artykułowi (ten sam tytuł, portal jeśli API go podaje) albo None."""
+    title = _norm(item.get('topic'))
+    portals = {_norm(item.get('portal_url')), _norm(item.get('portal_name'))} - {""}
+    for article in articles:
+        if _norm(article.get('title')) != title: continue
+        portal = _norm(article.get('portal_name'))
+        if not portal or portal in portals: return article
+    return None
+
+
+def _ensure_attempts(supabase, items):
+    """Zakłada wiersze publication_attempts (istniejące zostają nietknięte) i zwraca je wszystkie."""
+    rows = [{
+        "item_id": item['id'],
+        "idempotency_key": idempotency_key(item),
+        "wp_project_id": item.get('wp_project_id'),
+        "wp_portal_id": item.get('wp_portal_id'),
+    } for item in items]
+    for i in range(0, len(rows), CHUNK_SIZE):
+        supabase.table("publication_attempts").upsert(rows[i:i + CHUNK_SIZE], on_conflict="item_id", ignore_duplicates=True).execute()
+    return load_attempts(supabase, [item['id'] for item in items])
+
+
+def publish_items(supabase, wp_api, items, on_progress=None, confirmed=()):
+    """
+    Publikuje artykuły równolegle (pula wp_api.max_workers, limit zapytań wspólny z resztą API).
+    Przed wysłaniem każdy artykuł ma w publication_attempts status "dispatching"; wyniki i statusy
+    campaign_items zapisywane są hurtowo co takt pętli.
+    Przerwany przebieg można powtórzyć: artykuły "sent" są tylko oznaczane jako opublikowane.
+    Wynik artykułów w "dispatching" (także po wyjątku albo pustej odpowiedzi przy wysyłce)
+    jest nieznany, a API nie deduplikuje zleceń - są więc
+    uzgadniane z listą zleceń projektu; znalezione oznaczamy jako opublikowane, a pozostałe
+    wysyłamy ponownie tylko, gdy ich id są w `confirmed` (potwierdzenie operatora).
+    `items`: wiersze z id, wp_portal_id, wp_project_id, topic, portal_url/portal_name, content_html/content.
+    Zwraca słownik item_id -> "sent" / "already" / "unconfirmed" / "failed".
+    """
+    attempts = _ensure_attempts(supabase, items)
+    item_writer = BatchWriter(supabase, "campaign_items")
+    attempt_writer = BatchWriter(supabase, "publication_attempts")
+    confirmed = set(confirmed)
+    project_articles = {}
+    results = {}
+    to_send = []
+
+    def ordered(item):
+        project_id = item['wp_project_id']
+        if project_id not in project_articles:
+            try:
+                project_articles[project_id] = wp_api.get_project_articles(project_id)
+            except Exception as e:
+                logger.warning("Zlecenia projektu %s: %s", project_id, e)
+                project_articles[project_id] = []
+        return _ordered(item, project_articles[project_id])
+
+    for item in items:
+        attempt = attempts[item['id']]
+        if attempt['status'] == "sent":
+            # Wysłane w przerwanym przebiegu - brakuje tylko statusu artykułu
+            item_writer.add(item['id'], PUBLISHED)
+            results[item['id']] = "already"
+        elif not item.get('wp_project_id'):
+            attempt_writer.add(attempt['id'], {"status": "failed", "last_error": "Kampania nie ma klienta z wp_project_id", "updated_at": _now()})
+            results[item['id']] = "failed"
+        elif attempt['status'] == "dispatching" and item['id'] not in confirmed:
+            article = ordered(item)
+            if article is not None:
+                attempt_writer.add(attempt['id'], {"status": "sent", "response": {"reconciled": article.get('id')}, "last_error": None, "updated_at": _now()})
+                item_writer.add(item['id'], PUBLISHED)
+                results[item['id']] = "already"
+            else:
+                # Brak zlecenia na liście nie wyklucza, że wysyłka doszła - decyzja należy do operatora
+                results[item['id']] = "unconfirmed"
+        else:
+            to_send.append((item, attempt))
+
+    # Znacznik "dispatching" musi być w bazie przed pierwszym wysłaniem
+    now = _now()
+    for item, attempt in to_send:
+        attempt_writer.add(attempt['id'], {"status": "dispatching", "attempts": attempt['attempts'] + 1, "updated_at": now})
+    attempt_writer.flush()
+    item_writer.flush()
+    if on_progress: on_progress(len(results), len(items))
+
+    def dispatch(item, attempt):
+        return wp_api.publish_article(
+            item['wp_project_id'], item['wp_portal_id'], item['topic'],
+            item.get('content_html') or item.get('content'),
+            idempotency_key=attempt['idempotency_key']
+        )
+
+    executor = ThreadPoolExecutor(max_workers=max(1, wp_api.max_workers), thread_name_prefix="publish")
+    try:
+        futures = {executor.submit(dispatch, item, attempt): (item, attempt) for item, attempt in to_send}
+        pending = set(futures)
+        while pending:
+            finished, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+            for future in finished:
+                item, attempt = futures[future]
+                try:
+                    response = future.result()
+                except Exception as e:
+                    response, unknown = None, f"Wynik nieznany: {e}"
+                else:
+                    # Tylko jawne success: False jest odrzuceniem; pusta odpowiedź nie mówi, czy zlecenie doszło
+                    unknown = None if 'success' in (response or {}) else "Wynik nieznany: brak odpowiedzi API"
+                if unknown:
+                    # Zostaje "dispatching" - kolejny przebieg uzgodni go z listą zleceń projektu
+                    logger.warning("Publikacja artykułu %s: %s", item['id'], unknown)
+                    attempt_writer.add(attempt['id'], {"response": response, "last_error": unknown, "updated_at": _now()})
+                    results[item['id']] = "unconfirmed"
+                elif response['success']:
+                    attempt_writer.add(attempt['id'], {"status": "sent", "response": response, "last_error": None, "updated_at": _now()})
+                    item_writer.add(item['id'], PUBLISHED)
+                    results[item['id']] = "sent"
+                else:
+                    error = response.get('message') or "Publikacja odrzucona"
+                    logger.warning("Publikacja artykułu %s: %s", item['id'], error)
+                    attempt_writer.add(attempt['id'], {"status": "failed", "response": response, "last_error": error, "updated_at": _now()})
+                    results[item['id']] = "failed"
+            # Najpierw rejestr wysyłek, potem statusy artykułów
+            attempt_writer.flush()
+            item_writer.flush()
+            if on_progress: on_progress(len(results), len(items))
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        attempt_writer.flush()
+        item_writer.flush()
+    return results
@@ -0,0 +1,100 @@
+import time
+import random
+from email.utils import parsedate_to_datetime
+from services import local_store
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    blocked_until REAL NOT NULL DEFAULT 0
+);
+"""
+
+
+class TokenBucket:
+    """
+    Token bucket współdzielony przez wątki, sesje Streamlit i procesy na hoście.
+    Stan trzymany w SQLite, więc wszyscy operatorzy korzystają z jednego budżetu API.
+    """
+
+    def __init__(self, name, rate, capacity=1, db_name="ratelimit.sqlite"):
+        self.name = name
+        self.rate = float(rate)          # tokeny na sekundę
+        self.capacity = float(capacity)  # maksymalny "burst"
+        self.db_name = db_name
+
+    def _conn(self):
+        return local_store.connect(self.db_name, _SCHEMA)
+
+    def acquire(self, timeout=None):
+        """Blokuje do czasu pobrania tokenu. Zwraca False po przekroczeniu `timeout`."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        conn = self._conn()
+        while True:
+            now = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT tokens, updated_at, blocked_until FROM buckets WHERE name = ?", (self.name,)).fetchone()
+                if row is None:
+                    tokens, blocked_until = self.capacity, 0.0
+                else:
+                    elapsed = max(0.0, now - row["updated_at"])
+                    tokens = min(self.capacity, row["tokens"] + elapsed * self.rate)
+                    blocked_until = row["blocked_until"]
+
+                if now < blocked_until:
+                    wait = blocked_until - now
+                elif tokens >= 1:
+                    tokens -= 1
+                    wait = 0.0
+                else:
+                    wait = (1 - tokens) / self.rate
+
+                conn.execute(
+                    "INSERT INTO buckets (name, tokens, updated_at, blocked_until) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at, "
+                    "blocked_until = excluded.blocked_until",
+                    (self.name, tokens, now, blocked_until)
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+            if wait == 0.0:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            # Drobny jitter, żeby oczekujące procesy nie budziły się równocześnie
+            time.sleep(wait + random.uniform(0, 0.05))
+
+    def block_for(self, seconds):
+        """Wstrzymuje cały bucket (np. po 429 z Retry-After) dla wszystkich klientów."""
+        until = time.time() + max(0.0, float(seconds))
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO buckets (name, tokens, updated_at, blocked_until) VALUES (?, 0, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET tokens = 0, updated_at = excluded.updated_at, blocked_until = MAX(buckets.blocked_until, excluded.blocked_until)",
+            (self.name, time.time(), until)
+        )
+
+
+def parse_retry_after(value):
+    """Zamienia nagłówek Retry-After (sekundy lub data HTTP) na liczbę sekund albo None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    """Exponential backoff z pełnym jitterem (attempt liczony od 0)."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
@@ -0,0 +1,46 @@
+import streamlit as st
+from services.cache import stats_cache
+
+COUNTED_TABLES = ("clients", "campaigns", "campaign_items")
+
+
+def _ttl():
+    try:
+        return int(st.secrets.get("STATS", {}).get("TTL_SECONDS", 30))
+    except Exception:
+        return 30
+
+
+def count_rows(supabase, table, **filters):
+    """Liczba wierszy bez pobierania danych (HEAD z Content-Range)."""
+    query = supabase.table(table).select("id", count="exact", head=True)
+    for col, value in filters.items():
+        query = query.eq(col, value)
+    return query.execute().count or 0
+
+
+def totals(supabase):
+    """{tabela: liczba wierszy} - wspólne dla wszystkich sesji, odświeżane co [STATS] TTL_SECONDS."""
+    return stats_cache.get_or_set(
+        ("totals",),
+        lambda: {table: count_rows(supabase, table) for table in COUNTED_TABLES},
+        ttl=_ttl()
+    )
+
+
+def pipeline_counts(supabase):
+    """
+    {etap: {status: liczba}} z widoku pipeline_status_counts (sql/pipeline_status_counts.sql).
+    Widok liczony jest w bazie jednym zapytaniem; wynik trzymany w stats_cache.
+    """
+    def load():
+        rows = supabase.table("pipeline_status_counts").select("stage, status, n").execute().data
+        counts = {}
+        for r in rows:
+            counts.setdefault(r['stage'], {})[r['status']] = r['n']
+        return counts
+    return stats_cache.get_or_set(("pipeline",), load, ttl=_ttl())
+
+
+def invalidate():
+    stats_cache.clear()
@@ -1,6 +1,36 @@
 import streamlit as st
 import requests
 import time
+import math
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from services.rate_limit import TokenBucket, parse_retry_after, backoff_delay
+from services.http import get_session
+from services.cache import search_cache, canonical_hash
+from services import http_cache
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 502, 503, 504}
+
+# Próbowane od największego; pierwszy zaakceptowany rozmiar jest zapamiętywany per endpoint
+PER_PAGE_CANDIDATES = (100, 50, 25)
+_PER_PAGE_LIMITS = {}
+
+def _get_list(data):
+    return data.get('list') or data.get('data', {}).get('list') or []
+
+def _get_total_pages(data):
+    return int(data.get('totalPages') or data.get('data', {}).get('totalPages') or 1)
+
+
+class WhitePressError(Exception):
+    """Nieudane zapytanie (tylko przy _request(..., raise_errors=True)); `status` None = błąd sieci."""
+
+    def __init__(self, status, message=""):
+        super().__init__(f"{status}: {message}" if status else message)
+        self.status = status
+
 
 class WhitePressAPI:
     def __init__(self):
@@ -10,61 +40,153 @@ class WhitePressAPI:
             "Content-Type": "application/json",
             "Authorization": f"Bearer {self.api_key}"
         }
+        # Wspólny budżet zapytań dla wszystkich sesji/procesów na hoście
+        cfg = st.secrets["WHITEPRESS"]
+        self.max_retries = int(cfg.get("MAX_RETRIES", 5))
+        self.limiter = TokenBucket(
+            "whitepress",
+            rate=float(cfg.get("RATE_PER_SEC", 0.9)),
+            capacity=float(cfg.get("RATE_BURST", 1))
+        )
+        self.max_workers = int(cfg.get("MAX_WORKERS", 4))
+        self.session = get_session("whitepress")
 
-    def _request(self, endpoint, params=None, method="GET"):
-        """Wykonuje zapytanie do API z Rate Limitingiem (1.1s)."""
+    def _request(self, endpoint, params=None, method="GET", cache_ttl=None, raise_errors=False):
+        """
+        Wykonuje zapytanie do API przez wspólny token bucket, z ponowieniami (429/5xx).
+        Z `cache_ttl` odpowiedzi GET/OPTIONS trafiają do dyskowego http_cache: świeży wpis
+        nie zużywa limitu, przeterminowany jest rewalidowany nagłówkami ETag/Last-Modified.
+        Przy błędzie zwraca {} (albo nieświeży wpis), a z `raise_errors` rzuca WhitePressError.
+        """
         url = f"{self.base_url}{endpoint}"
+        cacheable = bool(cache_ttl) and method in ("GET", "OPTIONS")
+        entry = None
+        headers = self.headers
+        if cacheable:
+            cache_key = http_cache.make_key(method, url, params, self.api_key)
+            entry = http_cache.lookup(cache_key)
+            if entry and entry['fresh']:
+                return entry['data']
+            headers = {**self.headers, **http_cache.conditional_headers(entry)}
         
-        try:
-            response = requests.request(method, url, headers=self.headers, params=params if method == "GET" else None, json=params if method == "POST" else None)
-            time.sleep(1.1) 
-            
-            if response.status_code == 429:
-                st.warning("Przekroczono limit zapytań (429). Czekam 5 sekund...")
-                time.sleep(5)
-                return self._request(endpoint, params, method)
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            try:
+                response = self.session.request(method, url, headers=headers, params=params if method == "GET" else None, json=params if method == "POST" else None)
+            except requests.RequestException as e:
+                if attempt < self.max_retries:
+                    logger.warning("WhitePress %s %s: %s (próba %d)", method, endpoint, e, attempt + 1)
+                    time.sleep(backoff_delay(attempt))
+                    continue
+                if entry: return entry['data'] # Lepiej nieświeże dane niż żadne
+                st.error(f"Błąd połączenia z API WhitePress: {e}")
+                if raise_errors: raise WhitePressError(None, str(e))
+                return {}
+
+            if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                delay = parse_retry_after(response.headers.get("Retry-After"))
+                if delay is None:
+                    delay = backoff_delay(attempt, base=2.0)
+                if response.status_code == 429:
+                    # Wstrzymujemy cały bucket, żeby inne sesje nie dokładały kolejnych 429
+                    self.limiter.block_for(delay)
+                logger.warning("WhitePress %s %s -> %s, ponowienie za %.1fs", method, endpoint, response.status_code, delay)
+                time.sleep(delay)
+                continue
+
+            if response.status_code == 304 and entry:
+                http_cache.touch(cache_key, cache_ttl)
+                return entry['data']
 
             if response.status_code != 200:
+                if entry: return entry['data']
+                if raise_errors: raise WhitePressError(response.status_code, response.text[:200])
+                return {}
+
+            try:
+                data = response.json()
+            except ValueError as e:
+                st.error(f"Błąd połączenia z API WhitePress: {e}")
+                if raise_errors: raise WhitePressError(response.status_code, str(e))
                 return {}
-            
-            return response.json()
-        except Exception as e:
-            st.error(f"Błąd połączenia z API WhitePress: {e}")
-            return {}
+            if cacheable:
+                http_cache.store(cache_key, method, url, response.content, response.headers.get("ETag"), response.headers.get("Last-Modified"), cache_ttl)
+            return data
+        return entry['data'] if entry else {}
+
+    def _first_page(self, endpoint, params, kind):
+        """
+        Pobiera stronę 1 z największym per_page akceptowanym przez API. Zwraca (data, per_page).
+        Mniejszy rozmiar jest próbowany i zapamiętywany tylko, gdy API odrzuca per_page (4xx)
+        albo je przycina; błąd sieci/5xx kończy próbę bez zmiany zapamiętanego rozmiaru.
+        """
+        known = _PER_PAGE_LIMITS.get(kind)
+        sizes = (known,) if known else PER_PAGE_CANDIDATES
+        for size in sizes:
+            try:
+                data = self._request(endpoint, {**params, "per_page": size, "page": 1}, raise_errors=True)
+            except WhitePressError as e:
+                if e.status and 400 <= e.status < 500 and e.status != 429:
+                    continue # Odrzucony rozmiar -> próbujemy mniejszego
+                logger.warning("WhitePress %s: strona 1 niedostępna (%s)", endpoint, e)
+                return {}, size
+            got = len(_get_list(data))
+            if _get_total_pages(data) > 1 and 0 < got < size:
+                size = got # API po cichu przycięło per_page
+            _PER_PAGE_LIMITS[kind] = size
+            return data, size
+        return {}, sizes[-1]
+
+    def _paginate(self, endpoint, params=None, kind=None, max_items=None, strict=False):
+        """
+        Generator stron listy: strona 1 ustala totalPages, pozostałe pobierane są
+        równolegle (w granicach token bucketa) i oddawane w kolejności stron.
+        Przy `strict` pusta strona przed totalPages (błąd API) rzuca RuntimeError.
+        """
+        params = dict(params or {})
+        data, per_page = self._first_page(endpoint, params, kind or endpoint)
+        items = _get_list(data)
+        if not items: return
+        yield items
+
+        total = _get_total_pages(data)
+        if max_items: total = min(total, math.ceil(max_items / per_page))
+        if total <= 1: return
+
+        executor = ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, total - 1)))
+        try:
+            futures = [executor.submit(self._request, endpoint, {**params, "per_page": per_page, "page": p}) for p in range(2, total + 1)]
+            for page, f in enumerate(futures, start=2):
+                items = _get_list(f.result())
+                if not items:
+                    if strict: raise RuntimeError(f"Pusta strona {page}/{total} dla {endpoint}")
+                    break
+                yield items
+        finally:
+            # Konsument przerwał iterację -> nie pobieramy niepotrzebnych stron
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def iter_projects(self, strict=False):
+        """Projekty strona po stronie; przy `strict` niepełna lista (błąd strony) rzuca RuntimeError."""
+        for items in self._paginate("/v1/projects", kind="projects", strict=strict):
+            yield from items
 
     def get_projects(self):
         """Pobiera listę projektów."""
-        all_projects = []
-        page = 1
-        while True:
-            data = self._request("/v1/projects", {"per_page": 25, "page": page})
-            items = data.get('list') or data.get('data', {}).get('list') or []
-            if not items: break
-            all_projects.extend(items)
-            
-            total = data.get('totalPages') or data.get('data', {}).get('totalPages', 1)
-            if page >= total: break
-            page += 1
-        return all_projects
+        return list(self.iter_projects())
 
     @st.cache_data(ttl=3600)
     def get_portal_options(_self, project_id):
-        data = _self._request(f"/v1/seeding/{project_id}/portals", method="OPTIONS")
+        data = _self._request(f"/v1/seeding/{project_id}/portals", method="OPTIONS", cache_ttl=3600)
         return data.get('options') or data.get('data', {}).get('options') or {}
     
     def get_portal_offers(self, project_id, portal_id):
-        data = self._request(f"/v1/seeding/{project_id}/portals/{portal_id}")
+        data = self._request(f"/v1/seeding/{project_id}/portals/{portal_id}", cache_ttl=1800)
         return data.get('list') or data.get('data', {}).get('list') or []
 
-    def search_portals(self, project_id, filters, page=1, per_page=20):
-        """
-        Wyszukuje portale z paginacją. Zwraca (items, meta).
-        Meta zawiera: 'total_pages', 'total_items', 'current_page'
-        """
-        api_filters = {
-            "per_page": per_page, 
-            "page": page
-        }
+    def _portal_filter_params(self, filters):
+        """Mapuje słownik z render_filters_form na parametry filtering[...] API."""
+        api_filters = {}
         
         # --- Mapping Filters ---
         if filters.get('price_max'): api_filters["filtering[offer_price_max]"] = filters['price_max']
@@ -93,10 +215,29 @@ class WhitePressAPI:
         if filters.get('offer_persistence') and filters['offer_persistence'] != "All": api_filters["filtering[offer_persistence]"] = filters['offer_persistence']
         if filters.get('offer_tagging') and filters['offer_tagging'] != "All": api_filters["filtering[offer_tagging]"] = filters['offer_tagging']
 
+        return api_filters
+
+    def search_portals(self, project_id, filters, page=1, per_page=20):
+        """
+        Wyszukuje portale z paginacją. Zwraca (items, meta).
+        Meta zawiera: 'total_pages', 'total_items', 'current_page'
+        Wyniki trzymane w procesowym search_cache (klucz: projekt + hash filtrów + strona).
+        """
+        cache_key = (str(project_id), canonical_hash(filters), page, per_page)
+        cached = search_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        api_filters = {
+            "per_page": per_page, 
+            "page": page,
+            **self._portal_filter_params(filters)
+        }
+
         # Request
         data = self._request(f"/v1/seeding/{project_id}/portals", api_filters)
         
-        items = data.get('list') or data.get('data', {}).get('list') or []
+        items = _get_list(data)
         
         # Parse Meta
         meta_src = data.get('data', data) # Sometimes root, sometimes details
@@ -106,20 +247,28 @@ class WhitePressAPI:
             "current_page": page
         }
         
+        if items or data:
+            search_cache.set(cache_key, (items, meta))
         return items, meta
 
+    def iter_portals(self, project_id, filters, max_items=None, strict=False):
+        """Generator wszystkich portali spełniających filtry (strony pobierane równolegle)."""
+        pages = self._paginate(f"/v1/seeding/{project_id}/portals", self._portal_filter_params(filters), kind="portals", max_items=max_items, strict=strict)
+        for items in pages:
+            yield from items
+
+    def iter_project_articles(self, project_id):
+        for items in self._paginate(f"/v1/projects/{project_id}/articles", kind="articles"):
+            yield from items
+
     def get_project_articles(self, project_id):
-        all_articles = []
-        page = 1
-        while True:
-            data = self._request(f"/v1/projects/{project_id}/articles", {"per_page": 100, "page": page})
-            items = data.get('list') or data.get('data', {}).get('list') or []
-            if not items: break
-            all_articles.extend(items)
-            total = data.get('totalPages') or data.get('data', {}).get('totalPages', 1)
-            if page >= total: break
-            page += 1
-        return all_articles
-
-    def publish_article(self, project_id, portal_id, title, content):
-        return {"success": True, "message": "Artykuł wysłany do realizacji (Symulacja)"}
+        return list(self.iter_project_articles(project_id))
+
+    def publish_article(self, project_id, portal_id, title, content, idempotency_key=None):
+        """
+        Zleca publikację artykułu. `idempotency_key` identyfikuje zlecenie w publication_attempts -
+        API go nie obsługuje, więc ponowienie może utworzyć drugie zlecenie (patrz publish_items).
+        Zlecenie zużywa wspólny limit zapytań API.
+        """
+        self.limiter.acquire()
+        return {"success": True, "message": "Artykuł wysłany do realizacji (Symulacja)", "idempotency_key": idempotency_key}
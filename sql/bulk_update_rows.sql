@@ -0,0 +1,30 @@
+-- Hurtowa aktualizacja wielu wierszy z różnymi zmianami w jednym wywołaniu (services/batch.py).
+-- p_rows: [{"id": 1, "topic": "...", "language": "pl"}, {"id": 2, "status_brief": "done"}, ...]
+-- Każdy wiersz aktualizuje wyłącznie podane kolumny (w odróżnieniu od upsertu, który wymaga
+-- kompletu kolumn NOT NULL); typy konwertowane przez jsonb_populate_record.
+create or replace function bulk_update_rows(p_table text, p_rows jsonb)
+returns integer
+language plpgsql as $$
+declare
+    r jsonb;
+    assignments text;
+    affected integer := 0;
+    n integer;
+begin
+    if p_table not in ('campaign_items', 'campaigns', 'clients', 'publication_attempts') then
+        raise exception 'bulk_update_rows: tabela % niedozwolona', p_table;
+    end if;
+
+    for r in select value from jsonb_array_elements(p_rows) loop
+        select string_agg(format('%I = (jsonb_populate_record(null::%I, $1)).%I', k, p_table, k), ', ')
+          into assignments
+          from jsonb_object_keys(r - 'id') as k;
+        continue when assignments is null;
+
+        execute format('update %I set %s where id = ($1->>''id'')::bigint', p_table, assignments) using r;
+        get diagnostics n = row_count;
+        affected := affected + n;
+    end loop;
+    return affected;
+end;
+$$;
@@ -0,0 +1,42 @@
+-- Przegląd kampanii jednym zapytaniem: liczba artykułów i histogramy statusów etapów per kampania.
+-- LATERAL liczony jest tylko dla zwróconych kampanii, więc paginacja (order + range) nie skanuje
+-- całej tabeli campaign_items.
+create index if not exists campaign_items_campaign_id on campaign_items (campaign_id);
+
+create or replace view campaign_overview as
+select
+    c.id,
+    c.name,
+    c.status,
+    c.created_at,
+    c.client_id,
+    cl.name as client_name,
+    coalesce(agg.items_total, 0) as items_total,
+    coalesce(agg.items_written, 0) as items_written,
+    jsonb_build_object(
+        'research',  coalesce(agg.research, '{}'::jsonb),
+        'structure', coalesce(agg.structure, '{}'::jsonb),
+        'brief',     coalesce(agg.brief, '{}'::jsonb),
+        'writing',   coalesce(agg.writing, '{}'::jsonb)
+    ) as status_histogram
+from campaigns c
+left join clients cl on cl.id = c.client_id
+left join lateral (
+    select
+        count(*)::int as items_total,
+        count(*) filter (where i.status_writing = 'done')::int as items_written,
+        (select jsonb_object_agg(s, n) from (
+            select coalesce(status_research, 'pending') as s, count(*) as n
+            from campaign_items where campaign_id = c.id group by 1) h) as research,
+        (select jsonb_object_agg(s, n) from (
+            select coalesce(status_structure, 'pending') as s, count(*) as n
+            from campaign_items where campaign_id = c.id group by 1) h) as structure,
+        (select jsonb_object_agg(s, n) from (
+            select coalesce(status_brief, 'pending') as s, count(*) as n
+            from campaign_items where campaign_id = c.id group by 1) h) as brief,
+        (select jsonb_object_agg(s, n) from (
+            select coalesce(status_writing, 'pending') as s, count(*) as n
+            from campaign_items where campaign_id = c.id group by 1) h) as writing
+    from campaign_items i
+    where i.campaign_id = c.id
+) agg on true;
@@ -0,0 +1,77 @@
+-- Kolejka zadań pipeline'u treści (Research -> Struktura -> Brief -> Pisanie).
+-- Uruchom w SQL Editorze Supabase. Workery (worker.py) przejmują zadania przez RPC z dzierżawą (lease).
+
+create table if not exists pipeline_jobs (
+    id bigserial primary key,
+    item_id bigint not null references campaign_items(id) on delete cascade,
+    stage text not null,
+    status text not null default 'queued',      -- queued | running | done | error | cancelled
+    payload jsonb not null default '{}'::jsonb,
+    attempts int not null default 0,
+    max_attempts int not null default 3,
+    run_after timestamptz not null default now(),
+    lease_until timestamptz,
+    worker_id text,
+    heartbeat_at timestamptz,
+    result text,
+    last_error text,
+    created_at timestamptz not null default now(),
+    updated_at timestamptz not null default now()
+);
+
+create index if not exists pipeline_jobs_claim on pipeline_jobs (status, run_after);
+create index if not exists pipeline_jobs_item on pipeline_jobs (item_id, stage);
+-- Najwyżej jedno aktywne zadanie na (artykuł, etap) - chroni przed równoległym enqueue z dwóch kart/workerów.
+-- Przy istniejących duplikatach najpierw anuluj nadmiarowe: update pipeline_jobs set status = 'cancelled' where ...
+create unique index if not exists pipeline_jobs_active on pipeline_jobs (item_id, stage) where status in ('queued', 'running');
+
+-- Atomowe przejęcie do p_limit zadań: kolejka (run_after <= now) lub porzucone (wygasły lease, są jeszcze próby).
+create or replace function claim_pipeline_jobs(p_worker text, p_limit int, p_lease_seconds int, p_stages text[] default null)
+returns setof pipeline_jobs
+language plpgsql as $$
+begin
+    return query
+    update pipeline_jobs j
+       set status = 'running',
+           worker_id = p_worker,
+           attempts = j.attempts + 1,
+           lease_until = now() + make_interval(secs => p_lease_seconds),
+           heartbeat_at = now(),
+           updated_at = now()
+     where j.id in (
+        select id from pipeline_jobs
+         where ((status = 'queued' and run_after <= now())
+                or (status = 'running' and lease_until < now() and attempts < max_attempts))
+           and (p_stages is null or stage = any(p_stages))
+         order by run_after, id
+         limit p_limit
+         for update skip locked
+     )
+    returning j.*;
+end;
+$$;
+
+-- Porzucone zadania bez pozostałych prób -> 'error' (zwracane, by worker oznaczył artykuły).
+create or replace function reap_pipeline_jobs()
+returns setof pipeline_jobs
+language sql as $$
+    update pipeline_jobs
+       set status = 'error',
+           last_error = 'Lease wygasł przy ostatniej próbie (worker przerwany)',
+           lease_until = null,
+           updated_at = now()
+     where status = 'running' and lease_until < now() and attempts >= max_attempts
+    returning *;
+$$;
+
+-- Przedłużenie dzierżawy; zwraca false, jeśli zadanie przejął inny worker.
+create or replace function heartbeat_pipeline_job(p_id bigint, p_worker text, p_lease_seconds int)
+returns boolean
+language sql as $$
+    update pipeline_jobs
+       set lease_until = now() + make_interval(secs => p_lease_seconds),
+           heartbeat_at = now(),
+           updated_at = now()
+     where id = p_id and worker_id = p_worker and status = 'running'
+    returning true;
+$$;
@@ -0,0 +1,9 @@
+-- Liczniki statusów etapów pipeline'u w jednym zapytaniu (panel główny, services/stats.py).
+create or replace view pipeline_status_counts as
+select 'research' as stage, coalesce(status_research, 'pending') as status, count(*)::int as n from campaign_items group by 2
+union all
+select 'structure', coalesce(status_structure, 'pending'), count(*)::int from campaign_items group by 2
+union all
+select 'brief', coalesce(status_brief, 'pending'), count(*)::int from campaign_items group by 2
+union all
+select 'writing', coalesce(status_writing, 'pending'), count(*)::int from campaign_items group by 2;
@@ -0,0 +1,20 @@
+-- Rejestr publikacji w WhitePress: jeden wiersz na artykuł z kluczem idempotencji.
+-- Wiersz "dispatching" oznacza nieznany wynik (przerwany przebieg, wyjątek przy wysyłce). API nie
+-- deduplikuje zleceń, więc przy wznowieniu jest on uzgadniany z listą zleceń projektu, a bez dopasowania
+-- wysyłany ponownie tylko po potwierdzeniu operatora. "sent" nigdy nie jest wysyłany ponownie,
+-- "failed" (jawne odrzucenie przez API) - tak.
+create table if not exists publication_attempts (
+    id bigserial primary key,
+    item_id bigint not null unique references campaign_items(id) on delete cascade,
+    idempotency_key text not null unique,
+    wp_project_id bigint,
+    wp_portal_id bigint,
+    status text not null default 'pending',   -- pending | dispatching | sent | failed
+    attempts int not null default 0,
+    response jsonb,
+    last_error text,
+    created_at timestamptz not null default now(),
+    updated_at timestamptz not null default now()
+);
+
+create index if not exists publication_attempts_status on publication_attempts (status);
@@ -0,0 +1,5 @@
+-- Odciski wejść etapów pipeline'u (research/structure/brief/writing -> hash klucza workflow i wejść).
+-- Etap z niezmienionym odciskiem i zapisanym wynikiem (np. headings_final, content_html) jest pomijany
+-- bez wywołania Dify niezależnie od statusu ("queued"/"processing" z kolejki) - status wraca do "done".
+-- Wyjątek: przebieg z "Wymuś ponowne przeliczenie" (force).
+alter table campaign_items add column if not exists stage_fingerprints jsonb not null default '{}'::jsonb;
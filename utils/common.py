@@ -1,4 +1,7 @@
 import streamlit as st
+from datetime import datetime
+from services import catalog
+from services.cache import invalidate_project
 
 #--- HELPERS ---
 def get_option_label(options_dict, key, default="-"):
@@ -9,6 +12,26 @@ def get_option_label(options_dict, key, default="-"):
     if options_dict is None: return default
     return str(options_dict.get(str(key), default))
 
+def render_catalog_status(wp_api, project_id):
+    """
+    Shows the local portal catalog snapshot state with a manual refresh button.
+    """
+    info = catalog.snapshot_info(project_id)
+    c1, c2 = st.columns([4, 1])
+    if catalog.is_refreshing(project_id) or (info and info.get('status') == 'refreshing'):
+        c1.caption("🔄 Local catalog is refreshing in the background (API is used meanwhile).")
+    elif info and info.get('synced_at'):
+        synced = datetime.fromtimestamp(info['synced_at']).strftime("%d.%m.%Y %H:%M")
+        c1.caption(f"📦 Local catalog: {info['total']} portals, snapshot {synced} (+{info['changed']} / -{info['removed']} changed)")
+    else:
+        c1.caption("No local catalog yet - results come directly from the API.")
+    if info and info.get('status') == 'error':
+        c1.caption(f"⚠️ Last refresh failed: {info.get('error')}")
+    if c2.button("Refresh catalog", key=f"cat_refresh_{project_id}"):
+        invalidate_project(project_id)
+        catalog.ensure_fresh(wp_api, project_id, force=True)
+        st.rerun()
+
 def render_offer_row(offer, u_id, options={}, in_cart=False, show_actions=True):
     """
     Renders the offer exactly as received from API without translation.
@@ -1,7 +1,143 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime
-from utils.common import render_filters_form, render_offer_row
+from itertools import islice
+from services import catalog, offers
+from services.optimizer import optimize_selection, composite_scores, STRATEGY_WEIGHTS
+from utils.common import render_filters_form, render_offer_row, render_catalog_status
+
+@st.fragment(run_every=1)
+def _render_prefetch_progress(wp_api, project_id, portal_ids):
+    # Re-submit entries that expired meanwhile (empty offer lists are cached briefly)
+    offers.prefetch(wp_api, project_id, portal_ids)
+    done, total = offers.progress(project_id, portal_ids)
+    st.progress(done / total, text=f"Pobieranie ofert w tle: {done}/{total}")
+    if done >= total:
+        st.rerun()
+
+TUNING_PAGE_SIZE = 20
+
+def _compact_offer(o):
+    """Only what the campaign needs from an offer - kept per candidate in session_state."""
+    return {"offer_title": o.get('offer_title'), "best_price": o.get('best_price'), "offer_description": o.get('offer_description', "")}
+
+def _default_offer(item, portal_offers):
+    # Closest price to the one the generator picked, otherwise the first offer
+    return next((o for o in portal_offers if abs(float(o.get('best_price', 0)) - item['price']) < 0.1), portal_offers[0])
+
+def _effective_offer(item, project_id):
+    """Chosen offer: explicit choice, default from cached offers, or None while offers are loading."""
+    chosen = st.session_state.get('gen_selection', {}).get(item['wp_portal_id'])
+    if chosen: return chosen
+    portal_offers = offers.get_cached(project_id, item['wp_portal_id'])
+    if portal_offers is None: return None
+    if not portal_offers:
+        return {"offer_title": "Standard", "best_price": item['price'], "offer_description": ""}
+    return _compact_offer(_default_offer(item, portal_offers))
+
+def _final_item(item, sel_o):
+    final_item = item.copy()
+    final_item['price'] = float(sel_o.get('best_price', item['price'])) if sel_o else item['price']
+    final_item['offer_title'] = sel_o.get('offer_title') if sel_o else ""
+    final_item['offer_description'] = sel_o.get('offer_description') if sel_o else ""
+    return final_item
+
+def _render_details(project_id, item, options):
+    """Full info row and offer picker for one candidate (rendered only when it is opened)."""
+    pid = item['wp_portal_id']
+    p = item['full_data']
+
+    # 1. Condensed 9-col Info Row
+    # Portal | Type | UU | TF | DR | Dof | Index | Qual | Price
+    cw = [2, 1, 1, 1, 1, 1, 1, 1, 1]
+    cinfo = st.columns(cw)
+    cinfo[0].caption("Portal"); cinfo[0].write(f"**{p.get('portal_url')}**")
+    cinfo[1].caption("Rodzaj"); cinfo[1].write(p.get('portal_type', '-'))
+    cinfo[2].caption("UU"); cinfo[2].write(f"{p.get('portal_unique_users',0):,}")
+    cinfo[3].caption("TF"); cinfo[3].write(p.get('portal_score_trust_flow','-'))
+    cinfo[4].caption("DR"); cinfo[4].write(p.get('portal_score_domain_rating','-'))
+    cinfo[5].caption("Dof."); cinfo[5].write("✅" if p.get('offers_dofollow_count',0)>0 else "❌")
+    cinfo[6].caption("Index"); cinfo[6].write(p.get('indexation_speed', '-'))
+    cinfo[7].caption("Ocena"); cinfo[7].write(f"{p.get('portal_score_quality', '-')}/10")
+    cinfo[8].caption("Cena"); cinfo[8].write(f"{p.get('best_price',0):.2f}")
+    st.divider()
+
+    # 2. Offer Selection & Tuning
+    portal_offers = offers.get_cached(project_id, pid)
+    if portal_offers is None:
+        st.caption("⏳ Oferty są pobierane w tle...")
+    elif not portal_offers:
+        st.warning("Brak dodatkowych ofert.")
+    else:
+        offer_opts = {f"{o['offer_title']} ({o['best_price']} zł)": o for o in portal_offers}
+        labels = list(offer_opts.keys())
+        current = st.session_state['gen_selection'].get(pid) or _compact_offer(_default_offer(item, portal_offers))
+        def_key = next((k for k, o in offer_opts.items() if o.get('offer_title') == current['offer_title'] and o.get('best_price') == current['best_price']), labels[0])
+
+        col_sel, _ = st.columns([1, 1])
+        with col_sel:
+            sel_k = st.selectbox("Zmień ofertę:", labels, index=labels.index(def_key), key=f"gen_sel_{pid}")
+        sel_o = offer_opts[sel_k]
+        st.session_state['gen_selection'][pid] = _compact_offer(sel_o)
+
+        st.markdown("---")
+        # 3. Render Detail Row (selection is driven by the dropdown, so no action button)
+        render_offer_row(sel_o, u_id="dummy", options=options, in_cart=False, show_actions=False)
+
+@st.fragment
+def _render_tuning(project_id, candidates, budget, options):
+    """
+    Paginated candidate list: one compact table per page, details only for the selected row.
+    Widget changes rerun just this fragment; totals come from the compact selection state.
+    """
+    st.session_state.setdefault('gen_selection', {})
+    pages = max(1, -(-len(candidates) // TUNING_PAGE_SIZE))
+    page = min(st.session_state.get('gen_page', 1), pages)
+    start = (page - 1) * TUNING_PAGE_SIZE
+    page_items = candidates[start:start + TUNING_PAGE_SIZE]
+
+    summary = []
+    for idx, item in enumerate(page_items, start=start + 1):
+        sel_o = _effective_offer(item, project_id)
+        summary.append({
+            "#": idx,
+            "Portal": item['portal_url'],
+            "DR": item['metrics']['dr'],
+            "Oferta": sel_o.get('offer_title') if sel_o else "⏳",
+            "Cena": _final_item(item, sel_o)['price'],
+        })
+    event = st.dataframe(
+        pd.DataFrame(summary),
+        on_select="rerun",
+        selection_mode="single-row",
+        hide_index=True,
+        use_container_width=True,
+        key=f"gen_summary_{page}",
+        column_config={"Cena": st.column_config.NumberColumn(format="%.2f zł")}
+    )
+
+    if pages > 1:
+        c_prev, c_curr, c_next = st.columns([1, 2, 1])
+        if c_prev.button("⬅️ Poprzednie", disabled=page <= 1, key="gen_prev"):
+            st.session_state['gen_page'] = page - 1
+            st.rerun(scope="fragment")
+        c_curr.markdown(f"<div style='text-align: center'>Strona {page} z {pages} ({len(candidates)} portali)</div>", unsafe_allow_html=True)
+        if c_next.button("Następne ➡️", disabled=page >= pages, key="gen_next"):
+            st.session_state['gen_page'] = page + 1
+            st.rerun(scope="fragment")
+
+    rows = [i for i in event.selection.rows if i < len(page_items)]
+    if rows:
+        item = page_items[rows[0]]
+        with st.container(border=True):
+            st.markdown(f"**{start + rows[0] + 1}. {item['portal_url']}** | DR: {item['metrics']['dr']} | {item['price']:.2f} zł")
+            _render_details(project_id, item, options)
+    else:
+        st.caption("Zaznacz wiersz, aby zobaczyć szczegóły portalu i zmienić ofertę.")
+
+    running_cost = sum(_final_item(item, _effective_offer(item, project_id))['price'] for item in candidates)
+    st.divider()
+    st.metric("Razem", f"{running_cost:.2f} PLN", delta=f"{budget - running_cost:.2f} PLN wolne")
 
 def render(supabase, wp_api):
     st.title("Campaign Generator")
@@ -16,6 +152,8 @@ def render(supabase, wp_api):
     if selected_client_name:
         client = clients_map[selected_client_name]
         options = wp_api.get_portal_options(client['wp_project_id'])
+        catalog.ensure_fresh(wp_api, client['wp_project_id'])
+        render_catalog_status(wp_api, client['wp_project_id'])
         now_str = datetime.now().strftime("%d.%m.%Y %H:%M:%S")
 
         with st.form("campaign_form"):
@@ -35,6 +173,10 @@ def render(supabase, wp_api):
                     ("Zbalansowane (DR)", "portal_score_domain_rating"),
                     ("Najniższa Cena", "offer_price_min")
                 ], format_func=lambda x: x[0])
+                k1, k2, k3 = st.columns(3)
+                max_per_cat = k1.number_input("Max portali / kategoria (0 = bez limitu)", min_value=0, value=0, step=1)
+                max_per_country = k2.number_input("Max portali / kraj (0 = bez limitu)", min_value=0, value=0, step=1)
+                min_dofollow = k3.number_input("Min. udział dofollow (%)", min_value=0, max_value=100, value=0, step=5)
             
             with s2:
                 # Step 1: Check availability
@@ -44,79 +186,68 @@ def render(supabase, wp_api):
             
             if st.session_state.get('check_done'):
                 # Fetch only 1 item to get meta total
-                _, meta_check = wp_api.search_portals(client['wp_project_id'], st.session_state.get('check_filters', filters), page=1, per_page=1)
+                _, meta_check = catalog.search(wp_api, client['wp_project_id'], st.session_state.get('check_filters', filters), page=1, per_page=1)
                 total_avail = meta_check.get('total_items', 0)
                 st.info(f"Znaleziono {total_avail} portali spełniających kryteria.")
                 
                 # Step 2: Input Sample Size
-                sample_size = st.number_input("Ile portali przeanalizować do strategii? (Im więcej, tym lepiej, ale wolniej)", min_value=10, max_value=500, value=50, step=10)
+                sample_size = st.number_input("Ile portali przeanalizować do strategii? (Im więcej, tym lepiej, ale wolniej)", min_value=10, max_value=5000, value=50, step=10)
                 
                 # Step 3: Generate
                 if st.form_submit_button("2. Generuj Propozycję", type="primary"):
                     with st.spinner(f"Pobieranie i analiza {sample_size} portali..."):
                         
-                        # Fetch all pages needed to cover sample_size
-                        per_page = 50 # Max chunk
-                        import math
-                        pages_needed = math.ceil(sample_size / per_page)
-                        
-                        candidates_pool = []
-                        for p_idx in range(1, pages_needed + 1):
-                            chunk, _ = wp_api.search_portals(
-                                client['wp_project_id'], 
-                                st.session_state.get('check_filters', filters), 
-                                page=p_idx, 
-                                per_page=per_page
-                            )
-                            candidates_pool.extend(chunk)
-                            if len(candidates_pool) >= sample_size: break
-                        
-                        # Trim to sample size
-                        candidates_pool = candidates_pool[:sample_size]
-                        
-                        # Local Sorting
-                        sort_key = gen_strategy[1]
-                        reverse = True
-                        if sort_key == "offer_price_min": reverse = False # Cheapest first
+                        # Strony pobierane równolegle, przerywamy po uzbieraniu próbki
+                        portals_iter = catalog.iter_portals(
+                            wp_api,
+                            client['wp_project_id'], 
+                            st.session_state.get('check_filters', filters), 
+                            max_items=sample_size
+                        )
+                        candidates_pool = list(islice(portals_iter, sample_size))
+                        portals_iter.close()
                         
-                        # Helper to safely get sort value
-                        def get_val(item, key):
-                            val = item.get(key)
-                            if val is None: return 0
-                            try: return float(val)
-                            except: return 0
-
-                        candidates_sorted = sorted(candidates_pool, key=lambda x: get_val(x, sort_key), reverse=reverse)
+                        # Budget-optimal selection (knapsack over composite score)
+                        pool = [c for c in candidates_pool if float(c.get('best_price') or 0) > 0]
+                        result = optimize_selection(
+                            prices=[float(c['best_price']) for c in pool],
+                            scores=composite_scores(pool, STRATEGY_WEIGHTS[gen_strategy[1]]),
+                            budget=budget,
+                            group_keys={
+                                "category": [c.get('portal_categories') or [] for c in pool],
+                                "country": [[c.get('portal_country')] for c in pool],
+                            },
+                            caps={"category": max_per_cat, "country": max_per_country},
+                            dofollow=[(c.get('offers_dofollow_count') or 0) > 0 or c.get('offer_dofollow') == 1 for c in pool],
+                            min_dofollow_share=min_dofollow / 100.0
+                        )
                         
-                        # Greedy Selection
                         selected_items = []
-                        current_spend = 0
-                        
-                        for item in candidates_sorted:
-                            price = float(item.get('best_price', 0))
-                            if price <= 0: continue
-                            
-                            if current_spend + price <= budget:
-                                selected_items.append({
-                                    "wp_portal_id": item.get('id'),
-                                    "portal_name": item.get('name'),
-                                    "portal_url": item.get('portal_url', ''),
-                                    "price": price,
-                                    "metrics": {
-                                        "dr": int(item.get('portal_score_domain_rating', 0)),
-                                        "tf": int(item.get('portal_score_trust_flow', 0)),
-                                        "uu": item.get('portal_unique_users', 0)
-                                    },
-                                    "full_data": item
-                                })
-                                current_spend += price
+                        for i in result['selected']:
+                            item = pool[i]
+                            selected_items.append({
+                                "wp_portal_id": item.get('id'),
+                                "portal_name": item.get('name'),
+                                "portal_url": item.get('portal_url', ''),
+                                "price": float(item['best_price']),
+                                "metrics": {
+                                    "dr": int(item.get('portal_score_domain_rating', 0)),
+                                    "tf": int(item.get('portal_score_trust_flow', 0)),
+                                    "uu": item.get('portal_unique_users', 0)
+                                },
+                                "full_data": item
+                            })
                         
                         if not selected_items:
                             st.warning("Nie udało się dobrać portali do budżetu.")
                         else:
+                            # Offers for all candidates are fetched in the background right away
+                            offers.prefetch(wp_api, client['wp_project_id'], [x['wp_portal_id'] for x in selected_items])
                             st.session_state['campaign_candidates'] = selected_items
                             st.session_state['gen_meta'] = { "client_id": client['id'], "name": campaign_name, "budget": budget, "wp_project_id": client['wp_project_id'] }
                             st.session_state['check_done'] = False # Reset flow
+                            st.session_state['gen_selection'] = {}
+                            st.session_state['gen_page'] = 1
                             st.rerun()
 
         # --- SELECTION & TUNING ---
@@ -128,76 +259,27 @@ def render(supabase, wp_api):
             st.subheader("🛍️ Twoja Kampania")
             st.info("Przejrzyj i dostosuj wybrane oferty.")
 
+            portal_ids = [c['wp_portal_id'] for c in candidates]
+            offers.prefetch(wp_api, meta['wp_project_id'], portal_ids)
+            done, total = offers.progress(meta['wp_project_id'], portal_ids)
+            if done < total:
+                _render_prefetch_progress(wp_api, meta['wp_project_id'], portal_ids)
+
+            _render_tuning(meta['wp_project_id'], candidates, meta['budget'], options)
+
             final_list = []
             running_cost = 0
-            
-            for idx, item in enumerate(candidates):
-                pid = item['wp_portal_id']
-                p = item['full_data']
-                
-                title = f"{idx+1}. {item['portal_url']} | DR: {item['metrics']['dr']} | {item['price']:.2f} zł"
-                with st.expander(title, expanded=(idx==0)):
-                    
-                    # 1. Condensed 9-col Info Row
-                    # Portal | Type | UU | TF | DR | Dof | Index | Qual | Price
-                    cw = [2, 1, 1, 1, 1, 1, 1, 1, 1]
-                    cinfo = st.columns(cw)
-                    cinfo[0].caption("Portal"); cinfo[0].write(f"**{p.get('portal_url')}**")
-                    cinfo[1].caption("Rodzaj"); cinfo[1].write(p.get('portal_type', '-'))
-                    cinfo[2].caption("UU"); cinfo[2].write(f"{p.get('portal_unique_users',0):,}")
-                    cinfo[3].caption("TF"); cinfo[3].write(p.get('portal_score_trust_flow','-'))
-                    cinfo[4].caption("DR"); cinfo[4].write(p.get('portal_score_domain_rating','-'))
-                    cinfo[5].caption("Dof."); cinfo[5].write("✅" if p.get('offers_dofollow_count',0)>0 else "❌")
-                    cinfo[6].caption("Index"); cinfo[6].write(p.get('indexation_speed', '-'))
-                    cinfo[7].caption("Ocena"); cinfo[7].write(f"{p.get('portal_score_quality', '-')}/10")
-                    cinfo[8].caption("Cena"); cinfo[8].write(f"{p.get('best_price',0):.2f}")
-                    st.divider()
-                    
-                    # 2. Offer Selection & Tuning
-                    cache_key = f"gen_offers_{pid}"
-                    if cache_key not in st.session_state:
-                         st.session_state[cache_key] = wp_api.get_portal_offers(meta['wp_project_id'], pid)
-                    offers = st.session_state[cache_key]
-                    
-                    sel_o = None
-                    if not offers:
-                        sel_o = {"offer_title": "Standard", "best_price": item['price'], "offer_description": ""}
-                        st.warning("Brak dodatkowych ofert.")
-                    else:
-                        offer_opts = {}
-                        for o in offers:
-                            label = f"{o['offer_title']} ({o['best_price']} zł)"
-                            offer_opts[label] = o
-                        
-                        # Heuristic: Pick lowest price if not set, or maintain selection?
-                        # Generator logic usually resets, so pick closest price to initial 'item.price'
-                        def_key = next((k for k, v in offer_opts.items() if abs(float(v.get('best_price',0)) - item['price']) < 0.1), list(offer_opts.keys())[0])
-                        
-                        col_sel, _ = st.columns([1, 1])
-                        with col_sel:
-                             sel_k = st.selectbox("Zmień ofertę:", list(offer_opts.keys()), index=list(offer_opts.keys()).index(def_key), key=f"gen_sel_{pid}")
-                             sel_o = offer_opts[sel_k]
-                        
-                        st.markdown("---")
-                        
-                        # 3. Render Detail Row
-                        # We use 'render_offer_row' but maybe without 'Wybierz' button since the dropdown controls selection?
-                        # Or we show button as active "Selected"?
-                        # 'show_actions=False' hides the button.
-                        render_offer_row(sel_o, u_id="dummy", options=options, in_cart=False, show_actions=False)
-
-                # Add to final list
-                final_item = item.copy()
-                final_item['price'] = float(sel_o.get('best_price', item['price'])) if sel_o else item['price']
-                final_item['offer_title'] = sel_o.get('offer_title') if sel_o else ""
-                final_item['offer_description'] = sel_o.get('offer_description') if sel_o else ""
+            unresolved = 0
+            for item in candidates:
+                sel_o = _effective_offer(item, meta['wp_project_id'])
+                if sel_o is None: unresolved += 1
+                final_item = _final_item(item, sel_o)
                 final_list.append(final_item)
                 running_cost += final_item['price']
 
-            st.divider()
-            st.metric("Razem", f"{running_cost:.2f} PLN", delta=f"{meta['budget'] - running_cost:.2f} PLN wolne")
-            
-            if st.button("💾 Zapisz Kampanię", type="primary"):
+            if unresolved:
+                st.caption(f"Zapis będzie możliwy po pobraniu ofert ({unresolved} portali w toku).")
+            if st.button("💾 Zapisz Kampanię", type="primary", disabled=bool(unresolved)):
                 camp = supabase.table("campaigns").insert({
                     "client_id": meta['client_id'], "name": meta['name'], "budget_limit": running_cost, "status": "planned"
                 }).execute()
@@ -1,23 +1,56 @@
 import streamlit as st
 import pandas as pd
+from services.pipeline import STAGES, STAGE_ORDER
+
+PAGE_SIZE = 20
+ITEM_COLUMNS = "portal_url, topic, status_research, status_brief, status_writing"
+
+
+def _load_page(supabase, page):
+    """Strona kampanii z widoku campaign_overview (sql/campaign_overview.sql): liczniki i histogramy w jednym zapytaniu."""
+    start = (page - 1) * PAGE_SIZE
+    resp = supabase.table("campaign_overview").select("*", count="exact").order("created_at", desc=True).range(start, start + PAGE_SIZE - 1).execute()
+    return resp.data, resp.count or 0
+
+
+def _render_items(supabase, campaign_id):
+    items = supabase.table("campaign_items").select(ITEM_COLUMNS).eq("campaign_id", campaign_id).order("id").execute().data
+    if not items:
+        st.caption("Brak artykułów.")
+        return
+    df = pd.DataFrame(items)
+    status_cols = {"status_research": "Status Research", "status_brief": "Status Brief", "status_writing": "Status Pisanie"}
+    for col in status_cols:
+        if col not in df.columns: df[col] = None
+    # Brak statusu (NULL/"") pokazujemy jako "-"
+    df[list(status_cols)] = df[list(status_cols)].replace("", None).fillna("-")
+    st.dataframe(df.rename(columns=status_cols)[['portal_url', 'topic', *status_cols.values()]], use_container_width=True)
+
 
 def render(supabase):
     st.title("Kampanie")
     if supabase:
-        camps = supabase.table("campaigns").select("*, clients(name)").order("created_at", desc=True).execute()
-        for c in camps.data:
-            # Check for granular statuses to show progress
-            items = supabase.table("campaign_items").select("*").eq("campaign_id", c['id']).execute()
-            
-            with st.expander(f"{c['name']} | Status: {c['status']} | Ilość art: {len(items.data)}"):
-                if items.data:
-                    df = pd.DataFrame(items.data)
-                    # Helper func to safely get col or dash
-                    def get_col(row, col): return row.get(col) or '-'
-                    
-                    # Create readable status summary
-                    df['Status Research'] = df.apply(lambda r: get_col(r, 'status_research'), axis=1)
-                    df['Status Brief'] = df.apply(lambda r: get_col(r, 'status_brief'), axis=1)
-                    df['Status Pisanie'] = df.apply(lambda r: get_col(r, 'status_writing'), axis=1)
-                    
-                    st.dataframe(df[['portal_url', 'topic', 'Status Research', 'Status Brief', 'Status Pisanie']], use_container_width=True)
+        page = st.session_state.get("overview_page", 1)
+        camps, total = _load_page(supabase, page)
+        pages = max(1, -(-total // PAGE_SIZE))
+
+        for c in camps:
+            histogram = c.get('status_histogram') or {}
+            with st.expander(f"{c['name']} | Status: {c['status']} | Ilość art: {c['items_total']} | Napisane: {c['items_written']}"):
+                if c.get('client_name'): st.caption(f"Klient: {c['client_name']}")
+                if c['items_total']:
+                    hist = pd.DataFrame({STAGES[s]["label"]: histogram.get(s, {}) for s in STAGE_ORDER}).fillna(0).astype(int).T
+                    st.dataframe(hist, use_container_width=True)
+                    # Lista artykułów pobierana dopiero na żądanie
+                    if st.toggle("Pokaż artykuły", key=f"overview_items_{c['id']}"):
+                        _render_items(supabase, c['id'])
+
+        if pages > 1:
+            c1, c2, c3 = st.columns([1, 2, 1])
+            if c1.button("⬅️ Poprzednie", disabled=page <= 1):
+                st.session_state.overview_page = page - 1
+                st.rerun()
+            c2.markdown(f"<div style='text-align: center'>Strona {page} z {pages} ({total} kampanii)</div>", unsafe_allow_html=True)
+            if c3.button("Następne ➡️", disabled=page >= pages):
+                st.session_state.overview_page = page + 1
+                st.rerun()
@@ -1,7 +1,75 @@
 import streamlit as st
 import pandas as pd
 import time
-from services.dify import run_dify_workflow, clean_and_parse_json
+from services.pipeline import STAGES, STAGE_ORDER, WRITING_MODES, run_stage, run_chains, stage_concurrency
+from services.jobs import get_job_store
+from services.batch import BatchWriter, diff_rows
+from services.cache import canonical_hash
+
+# Tylko kolumny siatki - ciężkie pola (treść, brief, grafy) etapy pobierają same
+GRID_COLUMNS = "id, portal_url, topic, language, pipeline_status, extra_instructions, status_research, status_structure, status_brief, status_writing"
+STATUS_OPTIONS = ("pending", "queued", "processing", "done", "error")
+LANGUAGES = ["pl", "en", "de"]
+PAGE_SIZES = [50, 100, 250, 500]
+
+
+def _load_page(supabase, filters, after_id, page_size):
+    """
+    Strona siatki: paginacja po kluczu (id > after_id), filtry po stronie bazy.
+    Zwraca (wiersze, czy_jest_następna_strona).
+    """
+    query = supabase.table("campaign_items").select(GRID_COLUMNS).gt("id", after_id).order("id").limit(page_size + 1)
+    if filters['campaign_id'] is not None:
+        query = query.eq("campaign_id", filters['campaign_id'])
+    if filters['languages']:
+        query = query.in_("language", filters['languages'])
+    if filters['stage'] and filters['status']:
+        status_col = STAGES[filters['stage']]["status_col"]
+        if filters['status'] == "pending":
+            query = query.or_(f"{status_col}.is.null,{status_col}.eq.pending")
+        else:
+            query = query.eq(status_col, filters['status'])
+    rows = query.execute().data
+    return rows[:page_size], len(rows) > page_size
+
+
+@st.fragment(run_every=3)
+def _render_job_status(store, item_ids):
+    """Podgląd kolejki dla widocznych artykułów, odświeżany bez przeładowania strony."""
+    try:
+        jobs = store.jobs_for_items(item_ids)
+    except Exception:
+        st.caption("Brak tabeli pipeline_jobs (uruchom sql/pipeline_jobs.sql) - dostępny tylko tryb bezpośredni.")
+        return
+    active = [j for j in jobs if j['status'] in ("queued", "running")]
+    if not active and not st.session_state.get("jobs_watch"):
+        return
+    with st.expander(f"Kolejka zadań: {len(active)} aktywnych", expanded=bool(active)):
+        if jobs:
+            counts = pd.DataFrame(jobs).groupby(["stage", "status"]).size().unstack(fill_value=0)
+            st.dataframe(counts.reindex([s for s in STAGE_ORDER if s in counts.index]), use_container_width=True)
+            failed = [j for j in jobs if j['status'] == "error"][:10]
+            for j in failed:
+                st.caption(f"❌ #{j['item_id']} {STAGES[j['stage']]['label']}: {j.get('last_error') or ''}")
+    if st.session_state.get("jobs_watch") and not active:
+        # Kolejka opróżniona - jedno pełne odświeżenie, żeby tabela pokazała nowe statusy
+        st.session_state.jobs_watch = False
+        st.rerun()
+
+def _live_preview(rows):
+    """Live preview of articles being written: one slot per in-flight item. Returns (on_event, slots)."""
+    live_area = st.container()
+    live_slots = {}
+    topics = {r['id']: r['topic'] for r in rows}
+
+    def on_event(item_id, kind, payload):
+        if item_id not in live_slots: live_slots[item_id] = live_area.empty()
+        if kind == "text":
+            live_slots[item_id].markdown(f"**✍️ {topics.get(item_id)}**\n\n{payload[-1500:]}")
+        elif kind == "node" and payload:
+            live_slots[item_id].caption(f"✍️ {topics.get(item_id)}: {payload}...")
+
+    return on_event, live_slots
 
 def render(supabase):
     st.title("Planowanie Treści 🏭")
@@ -21,18 +89,33 @@ def render(supabase):
     camp_map = {c['name']: c['id'] for c in camps}
     
     # --- MODIFICATION: Default to None ---
-    sel_camp = st.selectbox("Wybierz Kampanię", ["-- Wszystkie --"] + list(camp_map.keys()), index=0)
-    
-    items_query = supabase.table("campaign_items").select("*").order("id")
-    
-    if sel_camp != "-- Wszystkie --":
-        camp_id = camp_map[sel_camp]
-        items_query = items_query.eq("campaign_id", camp_id)
-        
-    items = items_query.execute().data
+    f1, f2, f3, f4, f5 = st.columns([3, 2, 2, 2, 1])
+    sel_camp = f1.selectbox("Wybierz Kampanię", ["-- Wszystkie --"] + list(camp_map.keys()), index=0)
+    sel_stage = f2.selectbox("Etap", [None] + STAGE_ORDER, format_func=lambda s: "Wszystkie etapy" if s is None else STAGES[s]["label"])
+    sel_status = f3.selectbox("Status etapu", [None] + list(STATUS_OPTIONS), format_func=lambda s: "Dowolny" if s is None else s, disabled=sel_stage is None)
+    sel_langs = f4.multiselect("Język", LANGUAGES)
+    page_size = f5.selectbox("Na stronę", PAGE_SIZES, index=1)
+
+    filters = {
+        "campaign_id": camp_map.get(sel_camp),
+        "stage": sel_stage,
+        "status": sel_status if sel_stage else None,
+        "languages": sel_langs,
+        "page_size": page_size,
+    }
+    # Zmiana filtrów -> wracamy na pierwszą stronę
+    if st.session_state.get("planner_filters") != filters:
+        st.session_state.planner_filters = filters
+        st.session_state.planner_cursors = [0]
+    cursors = st.session_state.planner_cursors
+
+    items, has_next = _load_page(supabase, filters, cursors[-1], page_size)
     
     if not items:
         st.warning("Brak artykułów.")
+        if len(cursors) > 1 and st.button("⬅️ Poprzednia strona"):
+            cursors.pop()
+            st.rerun()
         return # Exit if empty
 
     # PRZYGOTOWANIE TABELI DO EDYCJI
@@ -41,16 +124,10 @@ def render(supabase):
     if "Wybierz" not in df.columns:
         df.insert(0, "Wybierz", False)
     
-    # Check for new columns compatibility (graceful fallback)
-    # status_research, status_structure, status_brief, status_writing
+    # Brak statusu etapu (NULL) traktujemy jak "pending"
     new_cols = ["status_research", "status_structure", "status_brief", "status_writing"]
     for nc in new_cols:
-        if nc not in df.columns:
-            df[nc] = "pending" # Default if DB not updated yet (though we asked user to)
-
-    cols_needed = ["id", "portal_url", "topic", "language", "pipeline_status", "extra_instructions", "frazy_senuto"]
-    for c in cols_needed:
-        if c not in df.columns: df[c] = None
+        df[nc] = df[nc].fillna("pending") if nc in df.columns else "pending"
 
     # Konfiguracja edytora
     col_config = {
@@ -59,7 +136,7 @@ def render(supabase):
         "topic": st.column_config.TextColumn("Temat / Fraza Główna", width="large", required=True),
         "portal_url": st.column_config.TextColumn("Portal", disabled=True),
         "pipeline_status": None, # Hide global status, use granular
-        "language": st.column_config.SelectboxColumn("Język", options=["pl", "en", "de"], default="pl", required=True),
+        "language": st.column_config.SelectboxColumn("Język", options=LANGUAGES, default="pl", required=True),
         "extra_instructions": st.column_config.TextColumn("Instrukcje"),
         
         # New Granular Status Columns
@@ -67,13 +144,6 @@ def render(supabase):
         "status_structure": st.column_config.TextColumn("Structure Status", disabled=True),
         "status_brief": st.column_config.TextColumn("Brief Status", disabled=True),
         "status_writing": st.column_config.TextColumn("Writing Status", disabled=True),
-
-        # Hidden cols
-        "knowledge_graph": None, "info_graph": None, "content_brief": None, "content_html": None,
-        "headings_extended": None, "headings_h2": None, "headings_questions": None, "headings_final": None,
-        "keywords_serp": None, "frazy_senuto": None, 
-        "created_at": None, "campaign_id": None, "wp_portal_id": None, 
-        "portal_name": None, "price": None, "metrics": None, "status": None, "content": None
     }
     
     st.caption("Zaznacz artykuły (checkbox po lewej) i kliknij przycisk akcji na dole.")
@@ -83,26 +153,35 @@ def render(supabase):
         column_config=col_config, 
         hide_index=True, 
         use_container_width=True, 
-        key="mass_editor",
+        key=f"mass_editor_{canonical_hash(filters)}_{cursors[-1]}", # Edits belong to one page of one filter set
         disabled=["id", "portal_url", "status_research", "status_structure", "status_brief", "status_writing"]
     )
+
+    p1, p2, p3 = st.columns([1, 2, 1])
+    if p1.button("⬅️ Poprzednia", disabled=len(cursors) <= 1):
+        cursors.pop()
+        st.rerun()
+    p2.markdown(f"<div style='text-align: center'>Strona {len(cursors)} (ID {items[0]['id']}–{items[-1]['id']})</div>", unsafe_allow_html=True)
+    if p3.button("Następna ➡️", disabled=not has_next):
+        cursors.append(items[-1]['id'])
+        st.rerun()
     
     if st.button("💾 Zapisz zmiany (Temat/Język/Instrukcje)"):
-        changes = 0
-        for index, row in edited_df.iterrows():
-            orig = next((x for x in items if x['id'] == row['id']), None)
-            if orig and (orig['topic'] != row['topic'] or orig['language'] != row['language'] or orig['extra_instructions'] != row['extra_instructions']):
-                supabase.table("campaign_items").update({
-                    "topic": row['topic'],
-                    "language": row['language'],
-                    "extra_instructions": row['extra_instructions']
-                }).eq("id", row['id']).execute()
-                changes += 1
+        changed = diff_rows(df, edited_df, ["topic", "language", "extra_instructions"])
+        writer = BatchWriter(supabase, "campaign_items")
+        for item_id, values in changed.items():
+            writer.add(item_id, values)
+        failed = writer.flush()
+        changes = len(changed) - len(failed)
+        if failed: st.error(f"Nie zapisano {len(failed)} rekordów: {sorted(failed)[:20]}")
         st.toast(f"Zaktualizowano {changes} rekordów.")
         time.sleep(1)
         st.rerun()
 
     st.divider()
+
+    job_store = get_job_store(supabase)
+    _render_job_status(job_store, [int(i) for i in df["id"]])
     
     selected_rows = edited_df[edited_df["Wybierz"] == True]
     count_sel = len(selected_rows)
@@ -110,153 +189,87 @@ def render(supabase):
     st.subheader(f"Akcje dla zaznaczonych: {count_sel}")
     
     if count_sel > 0:
-        c1, c2, c3, c4 = st.columns(4)
+        run_mode = st.radio(
+            "Tryb uruchomienia", ["Kolejka (w tle)", "Bezpośrednio (w tej sesji)"], horizontal=True,
+            help="Kolejka: zadania wykonuje worker.py niezależnie od przeglądarki. Bezpośrednio: przetwarzanie w tej sesji."
+        )
+        writing_mode = st.radio(
+            "Tryb pisania", WRITING_MODES, horizontal=True,
+            format_func=lambda m: {"sequential": "Sekcja po sekcji (podgląd na żywo)", "parallel": "Sekcje równolegle + zszycie"}[m],
+            help="Równolegle: sekcje pisane jednocześnie ze streszczeniem poprzednich, na końcu jeden przebieg ujednolicający."
+        )
+        force = st.checkbox("Wymuś ponowne przeliczenie", help="Pomija zapamiętane wyniki Dify i etapy z niezmienionymi danymi wejściowymi.")
+        c1, c2, c3, c4, c5 = st.columns(5)
         
-        # --- KROK 1: RESEARCH ---
-        if c1.button("1. Research"):
-            bar = st.progress(0)
-            for i, (_, row) in enumerate(selected_rows.iterrows()):
-                if not row['topic']: continue
-                
-                # Update status to processing
-                supabase.table("campaign_items").update({"status_research": "processing"}).eq("id", row['id']).execute()
-                
-                res = run_dify_workflow(st.secrets["DIFY"]["API_KEY_RESEARCH"], {
-                    "keyword": row['topic'],
-                    "language": row['language']
-                })
-                
-                if res.get('data', {}).get('status') == 'succeeded':
-                    out = res['data']['outputs']
-                    frazy_serp = out.get('frazy') or out.get('frazy z serp') or out.get('keywords') or row['topic']
-                    frazy_senuto_val = out.get('frazy_senuto', '')
-                    graf_info = out.get('grafinformacji') or out.get('graf') or out.get('information_graph') or ""
-                    graf_know = out.get('knowledge_graph') or out.get('graf wiedzy') or ""
-                    
-                    supabase.table("campaign_items").update({
-                        "keywords_serp": frazy_serp,
-                        "frazy_senuto": frazy_senuto_val,
-                        "info_graph": graf_info,
-                        "knowledge_graph": graf_know,
-                        "status_research": "done",       # Update granular
-                        "pipeline_status": "researched"  # Keep legacy for compatibility
-                    }).eq("id", row['id']).execute()
-                else:
-                    supabase.table("campaign_items").update({"status_research": "error"}).eq("id", row['id']).execute()
-                    st.error(f"Error {row['id']}")
-                bar.progress((i+1)/count_sel)
-            st.success("Research zakończony!")
-            st.rerun()
+        # Each stage runs its items on a bounded pool (limit per Dify workflow)
+        stage_clicked = None
+        if c1.button("1. Research"): stage_clicked = "research"
+        if c2.button("2. Struktura"): stage_clicked = "structure"
+        if c3.button("3. Brief"): stage_clicked = "brief"
+        if c4.button("4. Pisanie"): stage_clicked = "writing"
+        # Auto-pilot: each article goes through all stages on its own, without waiting for the batch
+        autopilot = c5.button("⚡ Auto-pilot (1→4)", type="primary")
 
-        # --- KROK 2: STRUKTURA ---
-        if c2.button("2. Struktura"):
+        if (stage_clicked or autopilot) and run_mode.startswith("Kolejka"):
+            ids = [int(i) for i in selected_rows["id"]]
+            first = stage_clicked or STAGE_ORDER[0]
+            payload = {"chain": STAGE_ORDER[1:]} if autopilot else {}
+            if force: payload["force"] = True
+            if first == "writing" or autopilot: payload["writing_mode"] = writing_mode
+            try:
+                added = job_store.enqueue([(i, first, payload) for i in ids])
+            except Exception as e:
+                st.error(f"Nie udało się dodać zadań do kolejki: {e}")
+                st.stop()
+            supabase.table("campaign_items").update({STAGES[first]["status_col"]: "queued"}).in_("id", ids).execute()
+            st.session_state.jobs_watch = True
+            st.toast(f"{'Auto-pilot' if autopilot else STAGES[first]['label']}: dodano {added} zadań do kolejki.")
+            time.sleep(1)
+            st.rerun()
+        elif autopilot:
+            rows = [{**r, "force": force, "writing_mode": writing_mode} for r in selected_rows[["id", "topic", "language", "extra_instructions"]].to_dict("records")]
+            status_ph = st.empty()
             bar = st.progress(0)
-            for i, (_, row) in enumerate(selected_rows.iterrows()):
-                supabase.table("campaign_items").update({"status_structure": "processing"}).eq("id", row['id']).execute()
-                
-                db_item = supabase.table("campaign_items").select("keywords_serp, info_graph").eq("id", row['id']).single().execute().data
-                frazy_val = db_item.get('keywords_serp') or row['topic']
-                graf_val = db_item.get('info_graph') or "Brak danych"
+            limits = ", ".join(f"{STAGES[s]['label']}: {stage_concurrency(s)}" for s in STAGE_ORDER)
+            status_ph.info(f"Auto-pilot: {count_sel} art. (równolegle - {limits})")
+            on_event, live_slots = _live_preview(rows)
 
-                res = run_dify_workflow(st.secrets["DIFY"]["API_KEY_HEADERS"], {
-                    "keyword": row['topic'],
-                    "language": row['language'],
-                    "frazy": frazy_val,
-                    "graf": graf_val
-                })
-                
-                if res.get('data', {}).get('status') == 'succeeded':
-                    out = res['data']['outputs']
-                    extended = out.get('naglowki_rozbudowane', '')
-                    supabase.table("campaign_items").update({
-                        "headings_extended": extended,
-                        "headings_h2": out.get('naglowki_h2'),
-                        "headings_questions": out.get('naglowki_pytania'),
-                        "headings_final": extended,
-                        "status_structure": "done",
-                        "pipeline_status": "structured"
-                    }).eq("id", row['id']).execute()
-                else:
-                    supabase.table("campaign_items").update({"status_structure": "error"}).eq("id", row['id']).execute()
-                bar.progress((i+1)/count_sel)
-            st.success("Gotowe!")
-            st.rerun()
+            def on_chain_progress(done, total, item_id, stage, result):
+                bar.progress(done / total, text=f"Auto-pilot: {done}/{total} etapów")
+                if stage == "writing" and item_id in live_slots: live_slots.pop(item_id).empty()
+                if result == "error":
+                    st.error(f"Error {item_id} ({STAGES[stage]['label']})")
 
-        # --- KROK 3: BRIEF ---
-        if c3.button("3. Brief"):
+            results = run_chains(supabase, rows, on_progress=on_chain_progress, on_event=on_event)
+            finished = sum(1 for r in results.values() if r.get("writing") == "done")
+            if finished == len(results):
+                status_ph.success("Auto-Pilot zakończył pracę!")
+                st.balloons()
+            else:
+                status_ph.warning(f"Auto-pilot: ukończono {finished}/{len(results)} artykułów.")
+            time.sleep(1)
+            st.rerun()
+        elif stage_clicked:
+            rows = [{**r, "force": force, "writing_mode": writing_mode} for r in selected_rows[["id", "topic", "language", "extra_instructions"]].to_dict("records")]
+            label = STAGES[stage_clicked]["label"]
+            status_ph = st.empty()
             bar = st.progress(0)
-            for i, (_, row) in enumerate(selected_rows.iterrows()):
-                supabase.table("campaign_items").update({"status_brief": "processing"}).eq("id", row['id']).execute()
-                
-                db_item = supabase.table("campaign_items").select("*").eq("id", row['id']).single().execute().data
-                if not db_item.get('headings_final'):
-                    continue
+            status_ph.info(f"{label}: {count_sel} art. (równolegle: {stage_concurrency(stage_clicked)})")
 
-                keywords_input = db_item.get('keywords_serp') or row['topic']
+            on_event, live_slots = _live_preview(rows)
 
-                res = run_dify_workflow(st.secrets["DIFY"]["API_KEY_BRIEF"], {
-                    "keywords": keywords_input, 
-                    "headings": db_item.get('headings_final', ''),
-                    "knowledge_graph": db_item.get('knowledge_graph', 'Brak'),
-                    "information_graph": db_item.get('info_graph', 'Brak'),
-                    "keyword": row['topic']
-                })
-                
-                if res.get('data', {}).get('status') == 'succeeded':
-                    raw_brief = res['data']['outputs'].get('brief', '[]')
-                    parsed = clean_and_parse_json(raw_brief)
-                    if parsed:
-                        supabase.table("campaign_items").update({
-                            "content_brief": parsed,
-                            "status_brief": "done",
-                            "pipeline_status": "briefed"
-                        }).eq("id", row['id']).execute()
-                else:
-                    supabase.table("campaign_items").update({"status_brief": "error"}).eq("id", row['id']).execute()
-                bar.progress((i+1)/count_sel)
-            st.success("Gotowe!")
-            st.rerun()
+            def on_progress(done, total, item_id, result):
+                bar.progress(done / total, text=f"{label}: {done}/{total}")
+                if item_id in live_slots: live_slots.pop(item_id).empty()
+                if result == "error":
+                    st.error(f"Error {item_id}")
 
-        # --- KROK 4: TREŚĆ ---
-        if c4.button("4. Pisanie"):
-            status_ph = st.empty()
-            main_bar = st.progress(0)
-            
-            for i, (_, row) in enumerate(selected_rows.iterrows()):
-                status_ph.info(f"Piszę: {row['topic']}")
-                supabase.table("campaign_items").update({"status_writing": "processing"}).eq("id", row['id']).execute()
-                
-                db_item = supabase.table("campaign_items").select("content_brief, headings_final").eq("id", row['id']).single().execute().data
-                brief = db_item.get('content_brief')
-                
-                if not brief: continue
-                    
-                full_content = ""
-                for section in brief:
-                    res = run_dify_workflow(st.secrets["DIFY"]["API_KEY_WRITE"], {
-                        "naglowek": section.get('heading'),
-                        "knowledge": section.get('knowledge'),
-                        "keywords": section.get('keywords'),
-                        "language": row['language'],
-                        "headings": db_item.get('headings_final'),
-                        "done": full_content,
-                        "keyword": row['topic'],
-                        "instruction": row['extra_instructions'] or ""
-                    })
-                    if res.get('data', {}).get('status') == 'succeeded':
-                        chunk = res['data']['outputs'].get('result') or res['data']['outputs'].get('text', '')
-                        full_content += chunk + "\n\n"
-                
-                supabase.table("campaign_items").update({
-                    "content_html": full_content,
-                    "content": full_content,
-                    "status_writing": "done",
-                    "pipeline_status": "content_ready",
-                    "status": "content_ready"
-                }).eq("id", row['id']).execute()
-                
-                main_bar.progress((i+1)/count_sel)
-            
-            status_ph.success("Gotowe!")
-            st.balloons()
+            results = run_stage(supabase, stage_clicked, rows, on_progress=on_progress, on_event=on_event)
+            errors = sum(1 for r in results.values() if r == "error")
+            if errors:
+                status_ph.warning(f"{label} zakończony, błędy: {errors}/{len(results)}")
+            else:
+                status_ph.success(f"{label} zakończony!")
+                if stage_clicked == "writing": st.balloons()
+            time.sleep(1)
             st.rerun()
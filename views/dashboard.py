@@ -1,4 +1,8 @@
 import streamlit as st
+import pandas as pd
+from services.http import pool_stats
+from services import cache, http_cache, dify_cache, stats
+from services.pipeline import STAGES, STAGE_ORDER
 
 def render(supabase):
     st.title("Panel Główny")
@@ -6,14 +10,49 @@ def render(supabase):
     
     if supabase:
         try:
-            clients_count = supabase.table("clients").select("*", count="exact").execute().count
-            campaigns_count = supabase.table("campaigns").select("*", count="exact").execute().count
-            articles_count = supabase.table("campaign_items").select("*", count="exact").execute().count
+            counts = stats.totals(supabase)
             
             col1, col2, col3 = st.columns(3)
-            col1.metric("Klienci", clients_count)
-            col2.metric("Kampanie", campaigns_count)
-            col3.metric("Zaplanowane Artykuły", articles_count)
+            col1.metric("Klienci", counts["clients"])
+            col2.metric("Kampanie", counts["campaigns"])
+            col3.metric("Zaplanowane Artykuły", counts["campaign_items"])
                     
         except Exception as e:
             st.error(f"Nie można połączyć się z bazą danych: {e}")
+
+        try:
+            pipeline = stats.pipeline_counts(supabase)
+            if pipeline:
+                st.subheader("Pipeline treści")
+                cols = st.columns(len(STAGE_ORDER))
+                for col, stage in zip(cols, STAGE_ORDER):
+                    by_status = pipeline.get(stage, {})
+                    col.metric(STAGES[stage]["label"], f"{by_status.get('done', 0)} ✓",
+                               delta=f"{by_status.get('error', 0)} błędów" if by_status.get('error') else None, delta_color="inverse")
+                    col.caption(" · ".join(f"{k}: {v}" for k, v in sorted(by_status.items()) if k != "done") or "-")
+        except Exception:
+            st.caption("Liczniki pipeline'u niedostępne (uruchom sql/pipeline_status_counts.sql).")
+
+    with st.expander("Połączenia HTTP (pule keep-alive)"):
+        pools = pool_stats()
+        if pools:
+            st.dataframe(pd.DataFrame(pools), use_container_width=True, hide_index=True)
+        else:
+            st.caption("Brak otwartych pul połączeń w tym procesie.")
+
+    with st.expander("Cache ofert i wyszukiwań"):
+        st.dataframe(pd.DataFrame(cache.all_stats()), use_container_width=True, hide_index=True)
+        disk = http_cache.stats()
+        st.caption(f"Dyskowy cache HTTP: {disk['entries']} odpowiedzi ({disk['fresh']} świeżych), {disk['bytes'] / 1024:.0f} KB po kompresji")
+        if st.button("Wyczyść cache"):
+            cache.offers_cache.clear()
+            cache.search_cache.clear()
+            http_cache.expire_all()
+            st.rerun()
+
+    with st.expander("Zapamiętane wyniki Dify"):
+        memo = dify_cache.stats()
+        st.caption(f"{memo['entries']} wyników workflow, {memo['hits']} ponownych użyć, {memo['bytes'] / 1024:.0f} KB po kompresji")
+        if st.button("Wyczyść wyniki Dify"):
+            dify_cache.clear()
+            st.rerun()
@@ -1,6 +1,157 @@
 import streamlit as st
 import pandas as pd
-from utils.common import render_filters_form, render_offer_row, get_option_label
+from services import catalog, offers
+from services.cache import canonical_hash
+from utils.common import render_filters_form, render_offer_row, get_option_label, render_catalog_status
+
+PAGE_SIZES = [10, 25, 50, 100]
+
+
+def _offers_panel(wp_api, project_id, r, opts):
+    """Offers of one portal with add/remove-to-cart actions (cart changes rerun the whole page)."""
+    pid = r.get('id')
+    my_offers = offers.get_offers(wp_api, project_id, pid)
+
+    if not my_offers:
+        st.warning("No offers found.")
+        return
+    for offer in my_offers:
+        # Construct unique ID for cart
+        u_id = f"{pid}_{offer.get('id')}"
+        in_cart = u_id in [x['unique_id'] for x in st.session_state['cart_items']]
+
+        action = render_offer_row(offer, u_id, options=opts, in_cart=in_cart, show_actions=True)
+
+        if action == "ADD":
+            st.session_state['cart_items'].append({
+                "unique_id": u_id,
+                "portal_id": pid,
+                "portal_url": r.get('portal_url'),
+                "metrics": {"dr": r.get('portal_score_domain_rating')},
+                "offer_title": offer.get('offer_title'),
+                "price": float(offer.get('best_price', 0))
+            })
+            st.rerun()
+        elif action == "REMOVE":
+            st.session_state['cart_items'] = [x for x in st.session_state['cart_items'] if x['unique_id'] != u_id]
+            st.rerun()
+
+        st.divider()
+
+
+def _grid_frame(portals, opts):
+    """One row per portal with labels resolved from the OPTIONS mapping."""
+    df = pd.DataFrame(portals)
+    for col in ("portal_url", "portal_unique_users", "portal_score_trust_flow", "portal_score_domain_rating", "best_price"):
+        if col not in df.columns: df[col] = None
+    type_opts = opts.get('portal_type') or {}
+    cat_opts = opts.get('portal_category') or {}
+    return pd.DataFrame({
+        "URL": df["portal_url"].fillna("No URL"),
+        # Ids mapped from the raw dicts - pandas would turn int ids with gaps into floats
+        "Type": [get_option_label(type_opts, r.get('portal_type'), str(r.get('portal_type'))) for r in portals],
+        "Categories": [
+            ", ".join(get_option_label(cat_opts, c, str(c)) for c in ids[:3]) if isinstance(ids, list) else "-"
+            for ids in (r.get('portal_categories') for r in portals)
+        ],
+        "UU": pd.to_numeric(df["portal_unique_users"], errors="coerce").fillna(0).astype(int),
+        "TF": pd.to_numeric(df["portal_score_trust_flow"], errors="coerce").fillna(0),
+        "DR": pd.to_numeric(df["portal_score_domain_rating"], errors="coerce").fillna(0),
+        "Dof": ["✅" if r.get('offer_dofollow') == 1 else "❌" for r in portals],
+        "Best Price": pd.to_numeric(df["best_price"], errors="coerce").fillna(0.0),
+    })
+
+
+@st.fragment
+def _render_grid(wp_api, project_id, portals, opts, grid_key):
+    """
+    Whole result page as one selectable table; the selected row drives the offers panel.
+    Selecting a row reruns only this fragment - the portal list is not fetched again.
+    """
+    if not portals: return
+    left, right = st.columns([3, 2])
+    with left:
+        event = st.dataframe(
+            _grid_frame(portals, opts),
+            on_select="rerun",
+            selection_mode="single-row",
+            hide_index=True,
+            use_container_width=True,
+            key=grid_key,
+            column_config={
+                "UU": st.column_config.NumberColumn(format="%d"),
+                "Best Price": st.column_config.NumberColumn(format="%.2f"),
+            }
+        )
+    with right:
+        rows = [i for i in event.selection.rows if i < len(portals)]
+        if not rows:
+            st.caption("Select a portal to see its offers.")
+        else:
+            r = portals[rows[0]]
+            st.info(f"Offers for {r.get('portal_url')} (ID: {r.get('id')})")
+            _offers_panel(wp_api, project_id, r, opts)
+
+
+def _render_rows(wp_api, project_id, portals, opts):
+    # --- GRID HEADER ---
+    # URL | Type | Cats | Users | TF | DR | Dof | Price | Action
+    w = [2.5, 1.5, 2, 1, 1, 1, 0.8, 1, 1]
+    headers = ["URL", "Type", "Categories", "UU", "TF", "DR", "Dof", "Best Price", "Action"]
+    cols = st.columns(w)
+    for c, h in zip(cols, headers): c.markdown(f"**{h}**")
+    st.divider()
+
+    # --- GRID ROWS ---
+    for r in portals:
+        pid = r.get('id')
+        with st.container():
+            c = st.columns(w)
+            
+            # 1. URL
+            c[0].write(f"**{r.get('portal_url', 'No URL')}**")
+            
+            # 2. Type (Map ID to Label)
+            type_id = r.get('portal_type')
+            type_label = get_option_label(opts.get('portal_type'), type_id, str(type_id))
+            c[1].write(type_label)
+            
+            # 3. Categories (List of IDs -> Labels)
+            cat_ids = r.get('portal_categories', []) # Note: API returns 'portal_categories' list
+            if isinstance(cat_ids, list):
+                cat_labels = [get_option_label(opts.get('portal_category'), cid, str(cid)) for cid in cat_ids]
+                c[2].caption(", ".join(cat_labels[:3])) # Show max 3
+            else:
+                c[2].write("-")
+            
+            # 4. Users (UU)
+            c[3].write(f"{r.get('portal_unique_users', 0):,}")
+            
+            # 5. TF
+            c[4].write(f"{r.get('portal_score_trust_flow', 0)}")
+            
+            # 6. DR
+            c[5].write(f"{r.get('portal_score_domain_rating', 0)}")
+            
+            # 7. Dofollow (1/0)
+            dof = r.get('offer_dofollow')
+            c[6].write("✅" if dof == 1 else "❌")
+            
+            # 8. Price
+            c[7].write(f"{r.get('best_price', 0):.2f}")
+            
+            # 9. Button
+            btn_label = "Hide" if pid in st.session_state['expanded_offers'] else "Offers"
+            if c[8].button(btn_label, key=f"btn_{pid}"):
+                if pid in st.session_state['expanded_offers']: st.session_state['expanded_offers'].remove(pid)
+                else: st.session_state['expanded_offers'].add(pid)
+                st.rerun()
+
+        # --- NESTED OFFERS ---
+        if pid in st.session_state['expanded_offers']:
+            st.info(f"Offers for ID: {pid}")
+            _offers_panel(wp_api, project_id, r, opts)
+        st.markdown("---")
 
 
 def render(supabase, wp_api):
@@ -16,10 +167,15 @@ def render(supabase, wp_api):
         
         # Fetch Options for Mapping
         opts = wp_api.get_portal_options(client['wp_project_id'])
+
+        # Local catalog mirror (refreshed in background when stale)
+        catalog.ensure_fresh(wp_api, client['wp_project_id'])
+        render_catalog_status(wp_api, client['wp_project_id'])
         
         # --- STATE MANAGEMENT ---
         if 'filters' not in st.session_state: st.session_state['filters'] = {}
         if 'page' not in st.session_state: st.session_state['page'] = 1
+        if 'per_page' not in st.session_state: st.session_state['per_page'] = PAGE_SIZES[0]
 
         # --- FILTER FORM ---
         with st.form("browse_form"):
@@ -29,13 +185,20 @@ def render(supabase, wp_api):
                 st.session_state['page'] = 1
                 st.rerun()
 
+        per_page = st.selectbox("Page size", PAGE_SIZES, index=PAGE_SIZES.index(st.session_state['per_page']))
+        if per_page != st.session_state['per_page']:
+            st.session_state['per_page'] = per_page
+            st.session_state['page'] = 1
+
         # --- FETCH DATA ---
+        # Neighbouring pages are usually already cached (or in flight) from the previous render
         with st.spinner("Fetching data..."):
-            portals, meta = wp_api.search_portals(
+            portals, meta = catalog.search(
+                wp_api,
                 client['wp_project_id'], 
                 st.session_state['filters'], 
                 page=st.session_state['page'], 
-                per_page=10
+                per_page=per_page
             )
 
         # --- RESULTS ---
@@ -45,98 +208,15 @@ def render(supabase, wp_api):
         if 'expanded_offers' not in st.session_state: st.session_state['expanded_offers'] = set()
         if 'cart_items' not in st.session_state: st.session_state['cart_items'] = []
 
-        # --- GRID HEADER ---
-        # URL | Type | Cats | Users | TF | DR | Dof | Price | Action
-        w = [2.5, 1.5, 2, 1, 1, 1, 0.8, 1, 1]
-        headers = ["URL", "Type", "Categories", "UU", "TF", "DR", "Dof", "Best Price", "Action"]
-        cols = st.columns(w)
-        for c, h in zip(cols, headers): c.markdown(f"**{h}**")
-        st.divider()
-
-        # --- GRID ROWS ---
-        for r in portals:
-            pid = r.get('id')
-            with st.container():
-                c = st.columns(w)
-                
-                # 1. URL
-                c[0].write(f"**{r.get('portal_url', 'No URL')}**")
-                
-                # 2. Type (Map ID to Label)
-                type_id = r.get('portal_type')
-                type_label = get_option_label(opts.get('portal_type'), type_id, str(type_id))
-                c[1].write(type_label)
-                
-                # 3. Categories (List of IDs -> Labels)
-                cat_ids = r.get('portal_categories', []) # Note: API returns 'portal_categories' list
-                if isinstance(cat_ids, list):
-                    cat_labels = [get_option_label(opts.get('portal_category'), cid, str(cid)) for cid in cat_ids]
-                    c[2].caption(", ".join(cat_labels[:3])) # Show max 3
-                else:
-                    c[2].write("-")
-                
-                # 4. Users (UU)
-                c[3].write(f"{r.get('portal_unique_users', 0):,}")
-                
-                # 5. TF
-                c[4].write(f"{r.get('portal_score_trust_flow', 0)}")
-                
-                # 6. DR
-                c[5].write(f"{r.get('portal_score_domain_rating', 0)}")
-                
-                # 7. Dofollow (1/0)
-                dof = r.get('offer_dofollow')
-                c[6].write("✅" if dof == 1 else "❌")
-                
-                # 8. Price
-                c[7].write(f"{r.get('best_price', 0):.2f}")
-                
-                # 9. Button
-                btn_label = "Hide" if pid in st.session_state['expanded_offers'] else "Offers"
-                if c[8].button(btn_label, key=f"btn_{pid}"):
-                    if pid in st.session_state['expanded_offers']: st.session_state['expanded_offers'].remove(pid)
-                    else: st.session_state['expanded_offers'].add(pid)
-                    st.rerun()
-
-            # --- NESTED OFFERS ---
-            if pid in st.session_state['expanded_offers']:
-                st.info(f"Offers for ID: {pid}")
-                
-                cache_key = f"offers_{pid}"
-                if cache_key not in st.session_state:
-                     st.session_state[cache_key] = wp_api.get_portal_offers(client['wp_project_id'], pid)
-                
-                my_offers = st.session_state[cache_key]
-                
-                if not my_offers:
-                    st.warning("No offers found.")
-                else:
-                    for offer in my_offers:
-                        # Construct unique ID for cart
-                        u_id = f"{pid}_{offer.get('id')}"
-                        in_cart = u_id in [x['unique_id'] for x in st.session_state['cart_items']]
-                        
-                        action = render_offer_row(offer, u_id, options=opts, in_cart=in_cart, show_actions=True)
-                        
-                        if action == "ADD":
-                            st.session_state['cart_items'].append({
-                                "unique_id": u_id, 
-                                "portal_id": pid, 
-                                "portal_url": r.get('portal_url'),
-                                "metrics": {"dr": r.get('portal_score_domain_rating')},
-                                "offer_title": offer.get('offer_title'),
-                                "price": float(offer.get('best_price', 0))
-                            })
-                            st.rerun()
-                        elif action == "REMOVE":
-                            st.session_state['cart_items'] = [x for x in st.session_state['cart_items'] if x['unique_id'] != u_id]
-                            st.rerun()
-                        
-                        st.divider()
-            st.markdown("---")
+        view_mode = st.radio("View", ["Grid", "Rows"], horizontal=True, key="browser_view")
+        if view_mode == "Grid":
+            _render_grid(wp_api, client['wp_project_id'], portals, opts, grid_key=f"portal_grid_{canonical_hash(st.session_state['filters'])}_{st.session_state['page']}_{per_page}")
+        else:
+            _render_rows(wp_api, client['wp_project_id'], portals, opts)
 
         # --- PAGINATION ---
         total_pages = meta.get('total_pages', 1)
+        catalog.prefetch_pages(wp_api, client['wp_project_id'], st.session_state['filters'], st.session_state['page'], per_page, total_pages)
         if total_pages > 1:
             c_prev, c_curr, c_next = st.columns([1, 1, 1])
             if st.session_state['page'] > 1:
@@ -1,36 +1,74 @@
 import streamlit as st
 import pandas as pd
+from services.publication import publish_items, project_ids_for_campaigns, load_attempts
+
+ITEM_COLUMNS = "id, campaign_id, topic, wp_portal_id, portal_url, portal_name, content_html, content, campaigns(name)"
+
+def _publish(supabase, wp_api, items, confirmed=()):
+    progress = st.progress(0)
+    results = publish_items(
+        supabase, wp_api, items,
+        on_progress=lambda done, total: progress.progress(done / total if total else 1.0, text=f"{done}/{total}"),
+        confirmed=confirmed
+    )
+    failed = [i for i, r in results.items() if r == "failed"]
+    unconfirmed = [i for i, r in results.items() if r == "unconfirmed"]
+    if unconfirmed:
+        st.warning(f"Nie znaleziono zleceń dla {len(unconfirmed)} art. przerwanych w trakcie wysyłki (ID: {unconfirmed[:20]}) - nie wysłano ich ponownie. Sprawdź projekt w WhitePress i potwierdź ponowną wysyłkę.")
+    return len(results) - len(failed) - len(unconfirmed), failed, unconfirmed
 
 def render(supabase, wp_api):
     st.title("Publikacja w WhitePress")
     if not supabase: st.stop()
-    
+
     # Pobieramy tylko gotowe
-    items = supabase.table("campaign_items").select("*, campaigns(name)").eq("pipeline_status", "content_ready").execute()
-    
+    items = supabase.table("campaign_items").select(ITEM_COLUMNS).eq("pipeline_status", "content_ready").execute()
+
     if not items.data:
         st.info("Brak gotowych artykułów do publikacji.")
     else:
+        # Projekt WhitePress wynika z klienta kampanii (campaigns -> clients.wp_project_id)
+        project_ids = project_ids_for_campaigns(supabase, [i['campaign_id'] for i in items.data])
+        for item in items.data:
+            item['wp_project_id'] = project_ids.get(item['campaign_id'])
+        try:
+            attempts = load_attempts(supabase, [i['id'] for i in items.data])
+        except Exception:
+            attempts = {}
+            st.caption("Brak tabeli publication_attempts (uruchom sql/publication_attempts.sql).")
+
         # Group by Campaign
         grouped = {}
         for item in items.data:
             c_name = item['campaigns']['name'] if item.get('campaigns') else "Bez kampanii"
             if c_name not in grouped: grouped[c_name] = []
             grouped[c_name].append(item)
-            
+
         st.write(f"Do publikacji: {len(items.data)} art. w {len(grouped)} kampaniach.")
-        
+
         for camp_name, camp_items in grouped.items():
             with st.expander(f"📦 {camp_name} ({len(camp_items)})", expanded=True):
+                interrupted = [i for i in camp_items if attempts.get(i['id'], {}).get('status') in ("failed", "sent")]
+                if interrupted:
+                    st.warning(f"Przerwana lub nieudana publikacja: {len(interrupted)} art. - ponowne uruchomienie dokończy ją.")
+                # Wynik nieznany: przed ponowną wysyłką uzgadniamy z listą zleceń projektu
+                dispatching = [i['id'] for i in camp_items if attempts.get(i['id'], {}).get('status') == "dispatching"]
+                confirmed = []
+                if dispatching:
+                    st.warning(f"Wysyłka przerwana w trakcie: {len(dispatching)} art. - zlecenia znalezione w projekcie zostaną oznaczone jako opublikowane, pozostałe nie będą wysłane ponownie bez potwierdzenia.")
+                    if st.checkbox("Sprawdziłem w WhitePress - brakujące zlecenia wyślij ponownie", key=f"confirm_{camp_name}"):
+                        confirmed = dispatching
+                if not all(i['wp_project_id'] for i in camp_items):
+                    st.error("Klient kampanii nie ma przypisanego projektu WhitePress (wp_project_id).")
+
                 # Bulk Action per campaign
                 if st.button(f"🚀 Opublikuj WSZYSTKIE z: {camp_name}", key=f"bulk_{camp_name}"):
-                    progress = st.progress(0)
-                    for idx, i in enumerate(camp_items):
-                        wp_api.publish_article(123, i['wp_portal_id'], i['topic'], i.get('content_html') or i.get('content'))
-                        supabase.table("campaign_items").update({"pipeline_status": "published", "status": "published"}).eq("id", i['id']).execute()
-                        progress.progress((idx+1)/len(camp_items))
-                    st.success(f"Wysłano {len(camp_items)} artykułów!")
-                    st.rerun()
+                    sent, failed, unconfirmed = _publish(supabase, wp_api, camp_items, confirmed)
+                    if failed:
+                        st.error(f"Wysłano {sent}, błędy: {len(failed)} (ID: {failed[:20]})")
+                    elif not unconfirmed:
+                        st.success(f"Wysłano {sent} artykułów!")
+                        st.rerun()
 
                 st.markdown("---")
                 # Individual Items
@@ -39,11 +77,16 @@ def render(supabase, wp_api):
                     with col1:
                         st.subheader(i['topic'])
                         st.caption(f"Portal: {i['portal_url']}")
+                        attempt = attempts.get(i['id'])
+                        if attempt and attempt.get('last_error'):
+                            st.caption(f"⚠️ Ostatnia próba: {attempt['last_error']}")
                         st.text_area("HTML Podgląd", i.get('content_html') or i.get('content'), height=100, key=f"txt_{i['id']}")
                     with col2:
                         if st.button(f"Opublikuj", key=f"pub_{i['id']}"):
-                            wp_api.publish_article(123, i['wp_portal_id'], i['topic'], i.get('content_html') or i.get('content'))
-                            supabase.table("campaign_items").update({"pipeline_status": "published", "status": "published"}).eq("id", i['id']).execute()
-                            st.success("Wysłano!")
-                            st.rerun()
+                            sent, failed, unconfirmed = _publish(supabase, wp_api, [i], confirmed)
+                            if failed:
+                                st.error("Publikacja nie powiodła się.")
+                            elif not unconfirmed:
+                                st.success("Wysłano!")
+                                st.rerun()
                     st.divider()
@@ -1,40 +1,44 @@
 import streamlit as st
 import pandas as pd
+from services.project_sync import sync_projects, load_clients
+from services import stats
 
 def render(supabase, wp_api):
     st.title("Synchronizacja Projektów")
-    st.info("Pobiera listę projektów z WhitePress i zapisuje lokalnie w bazie.")
-    
+    st.info("Pobiera listę projektów z WhitePress i zapisuje lokalnie w bazie (tylko nowe i zmienione).")
+
+    prune = st.checkbox("Usuń klientów, których projektów nie ma już w WhitePress", value=False)
+    dry_run = st.checkbox("Tylko podgląd zmian (bez zapisu)", value=False)
+
     if st.button("Pobierz projekty z WhitePress", type="primary"):
         if not supabase:
             st.error("Brak połączenia z bazą.")
         else:
             with st.spinner("Pobieranie danych z API WhitePress..."):
-                projects = wp_api.get_projects()
-                
-                if not projects:
-                    st.warning("API nie zwróciło żadnych projektów.")
+                report = sync_projects(supabase, wp_api, prune=prune, dry_run=dry_run)
+
+            if not report['projects']:
+                st.warning("API nie zwróciło żadnych projektów.")
+            else:
+                c1, c2, c3, c4 = st.columns(4)
+                c1.metric("Nowe", len(report['insert']))
+                c2.metric("Zmienione", len(report['update']))
+                c3.metric("Usunięte", len(report['delete']))
+                c4.metric("Bez zmian", report['unchanged'])
+                for error in report['errors']:
+                    st.error(error)
+                if report['insert'] or report['update']:
+                    with st.expander("Szczegóły zmian"):
+                        st.dataframe(pd.DataFrame(report['insert'] + report['update']), use_container_width=True)
+                if dry_run:
+                    st.info("Podgląd - nic nie zostało zapisane.")
                 else:
-                    count = 0
-                    for p in projects:
-                        project_title = p.get('title', p.get('name', 'Projekt bez nazwy'))
-                        project_id = p.get('id')
-                        project_url = p.get('url', '')
+                    stats.invalidate()
+                    if not report['errors']:
+                        st.success(f"Pomyślnie zsynchronizowano {report['projects']} projektów!")
 
-                        if project_id:
-                            data = {
-                                "wp_project_id": project_id,
-                                "name": project_title,
-                                "website": project_url
-                            }
-                            # Upsert clients
-                            supabase.table("clients").upsert(data, on_conflict="wp_project_id").execute()
-                            count += 1
-                    
-                    st.success(f"Pomyślnie zsynchronizowano {count} projektów!")
-    
     if supabase:
-        data = supabase.table("clients").select("*").execute()
-        if data.data:
-            df = pd.DataFrame(data.data)
+        clients = load_clients(supabase)
+        if clients:
+            df = pd.DataFrame(clients.values())
             st.dataframe(df[['wp_project_id', 'name', 'website']], use_container_width=True)
@@ -0,0 +1,201 @@
+"""
+Headless worker kolejki pipeline_jobs (Research -> Struktura -> Brief -> Pisanie).
+
+Uruchomienie (z katalogu aplikacji, korzysta z .streamlit/secrets.toml):
+    python worker.py --concurrency 4
+    python worker.py --stages research structure --once
+
+Wiele procesów/hostów może działać równolegle - zadania są przejmowane atomowo
+z dzierżawą (lease) odnawianą heartbeatem; zadanie porzucone przez martwy worker
+wraca do puli po wygaśnięciu lease.
+"""
+import os
+import time
+import uuid
+import socket
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from supabase import create_client
+import streamlit as st
+from services.jobs import get_job_store
+from services.pipeline import STAGES, STAGE_FUNCS, stage_concurrency
+from services.rate_limit import backoff_delay
+
+logger = logging.getLogger("linkai.worker")
+
+ITEM_COLUMNS = "id, topic, language, extra_instructions"
+ROW_OPTIONS = ("force", "writing_mode")
+
+
+class LeaseLost(Exception):
+    """Heartbeat stracił lease - zadanie przejął inny worker."""
+
+
+def _enqueue_next(supabase, store, job, chain):
+    """Kolejny etap łańcucha; błąd jest logowany i widoczny w statusie etapu zamiast cicho zgubić łańcuch."""
+    next_stage = chain[0]
+    status_col = STAGES[next_stage]["status_col"]
+    try:
+        store.enqueue([(job['item_id'], next_stage, {**job['payload'], "chain": chain[1:]})])
+    except Exception:
+        logger.exception("Zadanie %s (item %s): nie udało się dodać etapu %s - łańcuch przerwany", job['id'], job['item_id'], next_stage)
+        try:
+            supabase.table("campaign_items").update({status_col: "error"}).eq("id", job['item_id']).execute()
+        except Exception:
+            pass
+        return
+    try:
+        supabase.table("campaign_items").update({status_col: "queued"}).eq("id", job['item_id']).execute()
+    except Exception:
+        logger.exception("Zadanie %s (item %s): etap %s w kolejce, ale status nie został zapisany", job['id'], job['item_id'], next_stage)
+
+
+def run_job(supabase, store, worker_id, job, lost=None):
+    """Wykonuje zadanie. `lost` (threading.Event) ustawia heartbeat po utracie lease - etap jest wtedy przerywany."""
+    stage = job['stage']
+
+    def emit(kind, payload):
+        # Wołane przez etap w trakcie pracy (np. streaming sekcji) - punkt przerwania po utracie lease
+        if lost is not None and lost.is_set(): raise LeaseLost(job['id'])
+
+    try:
+        row = supabase.table("campaign_items").select(ITEM_COLUMNS).eq("id", job['item_id']).single().execute().data
+        # Opcje przebiegu z payloadu (force, writing_mode) trafiają do wiersza jak w trybie bezpośrednim
+        row.update({k: v for k, v in (job.get('payload') or {}).items() if k in ROW_OPTIONS})
+        result = STAGE_FUNCS[stage](supabase, row, emit)
+    except LeaseLost:
+        logger.warning("Zadanie %s (%s, item %s): przerwane po utracie lease", job['id'], stage, job['item_id'])
+        return
+    except Exception as e:
+        logger.exception("Zadanie %s (%s, item %s) nie powiodło się", job['id'], stage, job['item_id'])
+        result, error = "error", e
+    else:
+        error = "Workflow Dify zwrócił błąd" if result == "error" else None
+
+    if error is None:
+        if not store.complete(job['id'], worker_id, result):
+            # Zadanie przejął inny worker - on dokończy łańcuch
+            logger.warning("Zadanie %s (%s, item %s): lease utracony, pomijam kolejny etap", job['id'], stage, job['item_id'])
+            return
+        logger.info("Zadanie %s (%s, item %s): %s", job['id'], stage, job['item_id'], result)
+        # Auto-pilot: kolejny etap łańcucha trafia do kolejki od razu, bez czekania na resztę partii
+        chain = (job.get('payload') or {}).get('chain') or []
+        if result == "done" and chain:
+            _enqueue_next(supabase, store, job, chain)
+        return
+
+    retry = store.fail(job, worker_id, error, backoff_delay(job['attempts'], base=30.0, cap=900.0))
+    status_col = STAGES[stage]["status_col"]
+    try:
+        supabase.table("campaign_items").update({status_col: "queued" if retry else "error"}).eq("id", job['item_id']).execute()
+    except Exception:
+        pass
+    logger.warning("Zadanie %s (%s, item %s): błąd, %s", job['id'], stage, job['item_id'], "ponowienie" if retry else "koniec prób")
+
+
+class Worker:
+    def __init__(self, supabase, store, concurrency=4, stages=None, lease_seconds=300, poll_seconds=5.0):
+        self.supabase = supabase
+        self.store = store
+        self.concurrency = concurrency
+        self.stages = stages
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._running = {}
+        self._lost = {}
+        # Osobny limit per etap (workflow Dify), w ramach ogólnego --concurrency
+        self.stage_limits = {stage: stage_concurrency(stage) for stage in (stages or STAGES)}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _heartbeat_loop(self):
+        # Lease odnawiany co 1/3 jego długości; utrata lease = zadanie przejął ktoś inny
+        while not self._stop.wait(self.lease_seconds / 3):
+            with self._lock: job_ids = list(self._running)
+            for job_id in job_ids:
+                try:
+                    if not self.store.heartbeat(job_id, self.worker_id, self.lease_seconds):
+                        logger.warning("Utracono lease zadania %s", job_id)
+                        with self._lock: lost = self._lost.get(job_id)
+                        if lost is not None: lost.set()
+                except Exception as e:
+                    logger.warning("Heartbeat zadania %s: %s", job_id, e)
+
+    def _run(self, job):
+        with self._lock: lost = self._lost.setdefault(job['id'], threading.Event())
+        try:
+            run_job(self.supabase, self.store, self.worker_id, job, lost)
+        finally:
+            with self._lock:
+                self._running.pop(job['id'], None)
+                self._lost.pop(job['id'], None)
+
+    def _reap(self):
+        # Zadania, które przy ostatniej próbie zabiły swój worker, kończą się błędem zamiast wracać do puli
+        for job in self.store.reap():
+            logger.warning("Zadanie %s (%s, item %s): lease wygasł po ostatniej próbie", job['id'], job['stage'], job['item_id'])
+            try:
+                self.supabase.table("campaign_items").update({STAGES[job['stage']]["status_col"]: "error"}).eq("id", job['item_id']).execute()
+            except Exception:
+                pass
+
+    def _claim(self):
+        self._reap()
+        with self._lock: running = list(self._running.values())
+        free = self.concurrency - len(running)
+        jobs = []
+        for stage, limit in self.stage_limits.items():
+            stage_free = min(free - len(jobs), limit - sum(1 for j in running if j['stage'] == stage))
+            if stage_free > 0:
+                jobs.extend(self.store.claim(self.worker_id, stage_free, self.lease_seconds, [stage]))
+        return jobs
+
+    def run(self, once=False):
+        logger.info("Worker %s start (równolegle: %d, etapy: %s)", self.worker_id, self.concurrency, self.stages or "wszystkie")
+        heartbeat = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        heartbeat.start()
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="job") as executor:
+                while not self._stop.is_set():
+                    jobs = []
+                    try:
+                        jobs = self._claim()
+                    except Exception as e:
+                        logger.warning("Nie udało się pobrać zadań: %s", e)
+                    for job in jobs:
+                        with self._lock: self._running[job['id']] = job
+                        executor.submit(self._run, job)
+                    if once and not jobs:
+                        with self._lock: idle = not self._running
+                        if idle: break
+                    if not jobs:
+                        time.sleep(self.poll_seconds)
+        except KeyboardInterrupt:
+            logger.info("Zatrzymywanie - czekam na trwające zadania")
+        finally:
+            self._stop.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker kolejki pipeline'u treści")
+    parser.add_argument("--concurrency", type=int, default=4, help="Liczba równoległych zadań")
+    parser.add_argument("--stages", nargs="*", choices=list(STAGES), help="Obsługiwane etapy (domyślnie wszystkie)")
+    parser.add_argument("--lease", type=int, default=300, help="Długość dzierżawy zadania w sekundach")
+    parser.add_argument("--poll", type=float, default=5.0, help="Odstęp odpytywania pustej kolejki w sekundach")
+    parser.add_argument("--once", action="store_true", help="Zakończ, gdy kolejka jest pusta")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    supabase = create_client(st.secrets["SUPABASE"]["URL"], st.secrets["SUPABASE"]["KEY"])
+    Worker(
+        supabase, get_job_store(supabase),
+        concurrency=args.concurrency, stages=args.stages or None,
+        lease_seconds=args.lease, poll_seconds=args.poll
+    ).run(once=args.once)
+
+
+if __name__ == "__main__":
+    main()